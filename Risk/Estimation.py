@@ -1,20 +1,19 @@
 # Results for Liquid Collateral Minting Fees
 # 
 
-import datetime
-from math import dist
+from concurrent.futures import ProcessPoolExecutor
+import functools
 #from turtle import color
-import requests
-import json
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-from scipy import stats
-import statsmodels.api as sm
-import data_roller
-import random
-from scipy.stats import norm
-from scipy.stats import t as tdist
+from . import bootstrap
+from . import candle_store
+from . import instrument
+from . import result_cache
+from ._lazy import lazy
+
+plt = lazy("matplotlib.pyplot")
+stats = lazy("scipy.stats")
 
 
 def get_bootstrap_mtrx(rvec, tau, N):
@@ -30,22 +29,14 @@ def get_bootstrap_mtrx(rvec, tau, N):
         Rtau[:,k] = np.sum(R, 1)
     return Rtau.flatten()
 
-def get_block_bootstrap_mtrx(rvec, tau, TauIn, N):
+def get_block_bootstrap_mtrx(rvec, tau, TauIn, N, seed=None):
     # Construct matrix of block bootstrapped log-returns. time-length tau
     # The function will take tau/TauIn consecutive samples to construct one
     # observation
-    # N columns, rvec rows
-    num_returns_for_Rtau = int(tau/TauIn*60)
-    K = rvec.shape[0]
-    Rtau = np.zeros((N, K))
-    for j in range(N):
-        # one bootstrap sample
-        for k in range(K):
-            pivot = random.randrange(0, K)
-            idx = np.mod(pivot + np.arange(0, num_returns_for_Rtau), K)
-            ret_tau = np.sum(rvec[idx])
-            Rtau[j, k] = ret_tau
-    return Rtau
+    # N rows, rvec.shape[0] columns
+    # seed makes the matrix reproducible
+    num_returns_for_Rtau = bootstrap.block_length(tau, TauIn)
+    return bootstrap.block_bootstrap(rvec, num_returns_for_Rtau, N, seed)
 
 def estimate_hDash(alpha, Rtau):
     # for a given probability of liquidation, determine h'
@@ -88,25 +79,166 @@ def calc_pnl(hDash, Rtau, RtauMax):
     mu = np.mean(PnLvec)
     return [mu, s]
 
+def replication_stats(Rtau, RtauMax, hDashVec, h, rateK):
+    # per-replication statistics for every h' in hDashVec
+    # return (rows, 3, len(hDashVec)) with
+    # [:,0,:] probability of liquidation (RtauMax), as estimate_alpha_from_hDash
+    # [:,1,:] probability of liquidation not averted early (Rtau)
+    # [:,2,:] PnL, as calc_pnl
+    # Every row is sorted by RtauMax once and carries a prefix sum of
+    # exp(Rtau) in that order, so all thresholds are answered with
+    # searchsorted instead of one pass over the matrix per h'.
+    [rows, K] = Rtau.shape
+    thresh = np.log(1+h) - np.log(1+hDashVec)
+    order = np.argsort(RtauMax, 1)
+    max_sorted = np.take_along_axis(RtauMax, order, 1)
+    csum_exp = np.zeros((rows, K+1))
+    np.cumsum(np.exp(np.take_along_axis(Rtau, order, 1)), 1, out=csum_exp[:,1:])
+    del order
+    r_sorted = np.sort(Rtau, 1)
+    X = np.zeros((rows, 3, hDashVec.shape[0]))
+    for j in range(rows):
+        num_le_max = np.searchsorted(max_sorted[j], thresh, 'right')
+        num_lt_max = np.searchsorted(max_sorted[j], thresh, 'left')
+        X[j,0,:] = num_le_max/K
+        X[j,1,:] = np.searchsorted(r_sorted[j], thresh, 'right')/K
+        #Eq.(24) with D = (RtauMax<thresh)
+        X[j,2,:] = ((1+hDashVec)*csum_exp[j, num_lt_max] - (1+rateK)*num_lt_max)/K
+    return X
+
+def estimate_curves(sample, r, r_max, hDashVec, h, rateK, chunk_size=bootstrap.BATCH_SIZE):
+    # probability of liquidation and PnL curves over the whole hDashVec grid
+    # for a paired bootstrap sample. Rtau and RtauMax are derived from the
+    # sample's pivots chunk_size rows at a time.
+    # return [mu, s], each (3, len(hDashVec)), rows as in replication_stats
+    moments = bootstrap.RunningMoments((3, hDashVec.shape[0]))
+    with instrument.stage("h' sweep", replications=sample.shape[0],
+                          grid_points=sample.shape[0]*hDashVec.shape[0]):
+        for j in range(0, sample.shape[0], chunk_size):
+            rows = slice(j, j+chunk_size)
+            moments.add(replication_stats(sample.column(r, rows), sample.column(r_max, rows),
+                                          hDashVec, h, rateK))
+    return [moments.mean, np.sqrt(moments.var()/moments.n)]
+
+def estimate_curves_streaming(r, r_max, tau, TauIn, B, hDashVec, h, rateK,
+                              seed=None, workers=1, chunk_size=bootstrap.BATCH_SIZE):
+    # probability of liquidation and PnL curves over hDashVec without
+    # keeping the bootstrap sample. Replications are bootstrapped in chunks
+    # of chunk_size rows; peak memory is bounded by the chunk, not by B.
+    # Same seed and chunk_size give the same values as estimate_curves
+    # on bootstrap.sample_pivots(..., seed).
+    # return [mu, s], each (3, len(hDashVec)), rows as in replication_stats
+    stat = functools.partial(replication_stats, hDashVec=hDashVec, h=h, rateK=rateK)
+    with instrument.stage("bootstrap and h' sweep", replications=B,
+                          grid_points=B*hDashVec.shape[0]):
+        moments = bootstrap.bootstrap_moments([r, r_max], bootstrap.block_length(tau, TauIn), B,
+                                              stat, (3, hDashVec.shape[0]), seed, workers,
+                                              chunk_size)
+    return [moments.mean, np.sqrt(moments.var()/moments.n)]
+
+def _intraday_moments_batch(S, M, steps, seed_seq, rows, hDashVec, h, rateK):
+    # worker: paths of one batch from day blocks, reduced to moments
+    pivots = bootstrap._path_pivot_batch(S.shape[0], steps, seed_seq, rows)
+    [Rtau, RtauMax] = bootstrap.path_stats(S, M, pivots)
+    X = replication_stats(Rtau, RtauMax, hDashVec, h, rateK)
+    mean_b = np.mean(X, 0)
+    return [rows, mean_b, np.sum((X - mean_b)**2, 0)]
+
+def estimate_curves_intraday(timestamp, r, r_max, TauIn, tau, B, hDashVec, h, rateK,
+                             block_days=None, seed=None, workers=1, max_missing=0.1,
+                             chunk_size=bootstrap.BATCH_SIZE):
+    # probability of liquidation and PnL curves from a bootstrap of whole
+    # days built from intraday candles (e.g. TauIn=60). D is the true
+    # running maximum of the cumulative path below the threshold, instead
+    # of the sum of the maxRet of the candles.
+    # By default (block_days=None) each tau-hour path is one block of
+    # tau/24 consecutive days, as in the daily block bootstrap. A smaller
+    # block_days chains tau/(24*block_days) independently sampled blocks,
+    # which drops the dependence between the days of one path.
+    # One replication has as many paths as there are days. Missing
+    # candles are filled flat, up to the fraction max_missing.
+    # return [mu, s, report], mu and s each (3, len(hDashVec)), rows as in
+    # replication_stats, report the data_roller.GapReport of the candles
+    if block_days is None:
+        block_days = tau // 24
+    if block_days < 1 or tau % (24*block_days) != 0:
+        raise ValueError(f"tau={tau}h is not a positive multiple of blocks of whole days")
+    steps = tau // (24*block_days)
+    [r_grid, r_max_grid, per_day, report] = bootstrap.intraday_grid(timestamp, r, r_max,
+                                                                    TauIn, max_missing)
+    [S, M] = bootstrap.day_block_stats(r_grid, r_max_grid, per_day, block_days)
+    batches = bootstrap.batch_seeds(seed, B, chunk_size)
+    args = [[S]*len(batches), [M]*len(batches), [steps]*len(batches),
+            [ss for ss, _ in batches], [rows for _, rows in batches],
+            [hDashVec]*len(batches), [h]*len(batches), [rateK]*len(batches)]
+    moments = bootstrap.RunningMoments((3, hDashVec.shape[0]))
+    with instrument.stage("intraday bootstrap and h' sweep", replications=B,
+                          grid_points=B*hDashVec.shape[0]):
+        if workers <= 1:
+            for part in map(_intraday_moments_batch, *args):
+                moments.merge(*part)
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                for part in pool.map(_intraday_moments_batch, *args):
+                    moments.merge(*part)
+    return [moments.mean, np.sqrt(moments.var()/moments.n), report]
+
 if __name__ == "__main__":
     # candle time for the data (minutes)
     TauIn = 1440#60
 
-    DF = pd.read_pickle("./Risk/XBTCHF_"+str(TauIn)+"_Processed_v3.pkl")
+    candles = candle_store.load_candles(TauIn, ["logRet", "maxRet"])
 
-    r = DF["logRet"].to_numpy()
-    r_max = DF["maxRet"].to_numpy()
+    r = np.asarray(candles["logRet"])
+    r_max = np.asarray(candles["maxRet"])
     # parameters
     h = 0.10 # required maintenance margin and ultimately the haircut
     rateK = 0.02 # challenger fee
     tau = 24 # duration for liquidation in hours. 24 hours is used in main part of paper
 
     B = 5_000#10_000
-    # bootstrap returns
-    #Rtau = get_bootstrap_mtrx(r, tau, N)
-    Rtau = get_block_bootstrap_mtrx(r, tau, TauIn, B)
-    RtauMax = get_block_bootstrap_mtrx(r_max, tau, TauIn, B)
-    K = Rtau.shape[1]
+    seed = 42
+    workers = 1 # processes for the streaming and intraday bootstrap, os.cpu_count() for all cores
+    streaming = False # bootstrap in chunks, memory bounded by the chunk size
+    use_cache = result_cache.enabled() # reload the curves for unchanged data and parameters
+    # sample whole days but build the paths from hourly candles, with the
+    # running maximum of the path instead of the sum of maxRet for D
+    intraday = False
+    block_days = tau // 24 # days per sampled block, tau // 24 for one contiguous block
+    if intraday:
+        hourly = candle_store.load_candles(60, ["timestamp", "logRet", "maxRet"])
+        curve_data = [np.asarray(hourly[c]) for c in ["timestamp", "logRet", "maxRet"]]
+    else:
+        curve_data = [r, r_max]
+    hDashVec = np.arange(-0.05, 0.25, 0.005);
+
+    def compute_curves():
+        if intraday:
+            [mu, s, report] = estimate_curves_intraday(*curve_data, 60, tau, B, hDashVec,
+                                                       h, rateK, block_days, seed, workers)
+            print(f"{report.missing_ratio:.1%} of the hourly candles missing, filled flat "
+                  f"({report.gaps.shape[0]} gaps)")
+        elif streaming:
+            [mu, s] = estimate_curves_streaming(r, r_max, tau, TauIn, B,
+                                                hDashVec, h, rateK, seed, workers)
+        else:
+            # bootstrap returns: one set of block pivots, Rtau and RtauMax
+            # are derived from it and therefore paired
+            #Rtau = get_bootstrap_mtrx(r, tau, N)
+            sample = bootstrap.sample_pivots(r.shape[0], bootstrap.block_length(tau, TauIn),
+                                             B, seed)
+            [mu, s] = estimate_curves(sample, r, r_max, hDashVec, h, rateK)
+        return {"mu_curves": mu, "s_curves": s}
+
+    if use_cache and seed is not None:
+        params = {"TauIn": TauIn, "tau": tau, "B": B, "seed": seed, "h": h, "rateK": rateK,
+                  "method": "intraday" if intraday else "streaming" if streaming else "block_bootstrap"}
+        if intraday:
+            params["block_days"] = block_days
+        curves = result_cache.ResultCache().cached(curve_data + [hDashVec], params, compute_curves)
+    else:
+        curves = compute_curves()
+    [mu_curves, s_curves] = [curves["mu_curves"], curves["s_curves"]]
     # monte-carlo integration
     #Lvec[j] = -np.sum(np.minimum((1+h)*np.exp(Rtau)-(1+k), h-k))/K
 
@@ -125,55 +257,56 @@ if __name__ == "__main__":
     # theoretical probability of liquidation assuming a normal distribution
     mu_r = np.mean(r)
     sig_r = np.std(r)
-    def eval_prob_theo(hDash): return norm.cdf((np.log(1+h) - np.log(1+hDash) - mu_r ) / sig_r)
+    def eval_prob_theo(hDash): return stats.norm.cdf((np.log(1+h) - np.log(1+hDash) - mu_r ) / sig_r)
 
-    T = norm.ppf(0.99)
-    hDashVec = np.arange(-0.05, 0.25, 0.005);
+    T = stats.norm.ppf(0.99)
     Prob = np.zeros((hDashVec.shape[0],2))
     Prob_noearly = np.zeros((hDashVec.shape[0],2)) #no early end
     Prob_theo = np.zeros((hDashVec.shape[0],1))
     pnl_vec = np.zeros((hDashVec.shape[0],2))
     t=0
     for hD in hDashVec:
-        [m,s] = estimate_alpha_from_hDash(hD, RtauMax)
-        Prob[t,:] = [m*100, T*s*100]
-        [m,s] = estimate_alpha_from_hDash(hD, Rtau)
+        # same as estimate_alpha_from_hDash(hD, RtauMax), estimate_alpha_from_hDash(hD, Rtau)
+        # and calc_pnl(hD, Rtau, RtauMax), evaluated for the whole grid at once
+        [m_max, m, m_pnl] = mu_curves[:,t]
+        [s_max, s, s_pnl] = s_curves[:,t]
+        Prob[t,:] = [m_max*100, T*s_max*100]
         Prob_noearly[t,:] = [m*100, T*s*100]
         Prob_theo[t] = eval_prob_theo(hD) * 100.0
-        [m_pnl,s_pnl] = calc_pnl(hD, Rtau, RtauMax);
         pnl_vec[t,:] = [m_pnl*100, T*s_pnl*100]
         print(f"h'={hD:.2f} alpha={m*100:.2f} +/- {T*s*100:.2f} PnL={m_pnl*100:.2f} +/- {T*s_pnl*100:.2f}");
         t = t + 1
 
-    # plot probability of liquidation given h'
-    plt.figure
-    plot_ticks = np.arange(-0.04, 0.25, 0.02)
-    lbls = [ "{:0.0f}".format(x) for x in 100*(1+plot_ticks) ]
-    plt.plot(100*(1+hDashVec), Prob[:,0], 'k-', label='empirical')
-    plt.plot(100*(1+hDashVec), Prob_noearly[:,0], '--', color="cadetblue", label='empirical: not averted early')
-    plt.plot(100*(1+hDashVec), Prob_theo[:,0], 'b:', label='normal: not averted early')
-    plt.xticks(ticks=100*(1+plot_ticks), labels = lbls)
-    plt.yticks(ticks=np.arange(0,101,10), labels = [ "{:0.0f}".format(x) for x in np.arange(0,101,10) ])
-    plt.xlabel("(1+h'), %")
-    plt.ylabel("Probability of liquidation, %")
-    plt.axvline(x=110, color='r', linestyle='--', label='(1+h), %')
-    plt.legend()
-    plt.grid()
-    plt.show()
-
-    # plot PnL given h'
-    plt.figure
-    plot_ticks = np.arange(-0.04, 0.25, 0.02)
-    lbls = [ "{:0.0f}".format(x) for x in 100*(1+plot_ticks) ]
-    plt.plot(100*(1+hDashVec), pnl_vec[:,0], '-', label='pnl')
-    plt.xticks(ticks=100*(1+plot_ticks), labels = lbls)
-    plt.yticks(ticks=np.arange(-6,3.5,1), labels = [ "{:0.2f}".format(x) for x in np.arange(-6,3.5,1) ])
-    plt.xlabel("(1+h'), %")
-    plt.ylabel("E[P|h'], %")
-    plt.axvline(x=110, color='r', linestyle='--', label='(1+h), %')
-    plt.legend()
-    plt.grid()
-    plt.show()
+    with instrument.stage("plots"):
+        # plot probability of liquidation given h'
+        plt.figure
+        plot_ticks = np.arange(-0.04, 0.25, 0.02)
+        lbls = [ "{:0.0f}".format(x) for x in 100*(1+plot_ticks) ]
+        plt.plot(100*(1+hDashVec), Prob[:,0], 'k-', label='empirical')
+        plt.plot(100*(1+hDashVec), Prob_noearly[:,0], '--', color="cadetblue", label='empirical: not averted early')
+        plt.plot(100*(1+hDashVec), Prob_theo[:,0], 'b:', label='normal: not averted early')
+        plt.xticks(ticks=100*(1+plot_ticks), labels = lbls)
+        plt.yticks(ticks=np.arange(0,101,10), labels = [ "{:0.0f}".format(x) for x in np.arange(0,101,10) ])
+        plt.xlabel("(1+h'), %")
+        plt.ylabel("Probability of liquidation, %")
+        plt.axvline(x=110, color='r', linestyle='--', label='(1+h), %')
+        plt.legend()
+        plt.grid()
+        plt.show()
+
+        # plot PnL given h'
+        plt.figure
+        plot_ticks = np.arange(-0.04, 0.25, 0.02)
+        lbls = [ "{:0.0f}".format(x) for x in 100*(1+plot_ticks) ]
+        plt.plot(100*(1+hDashVec), pnl_vec[:,0], '-', label='pnl')
+        plt.xticks(ticks=100*(1+plot_ticks), labels = lbls)
+        plt.yticks(ticks=np.arange(-6,3.5,1), labels = [ "{:0.2f}".format(x) for x in np.arange(-6,3.5,1) ])
+        plt.xlabel("(1+h'), %")
+        plt.ylabel("E[P|h'], %")
+        plt.axvline(x=110, color='r', linestyle='--', label='(1+h), %')
+        plt.legend()
+        plt.grid()
+        plt.show()
 
 
     # empirical ES. This is properly dealt with in
@@ -3,15 +3,15 @@
 
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
+from . import rolling
+from . import candle_store
+from ._lazy import lazy
+
+plt = lazy("matplotlib.pyplot")
 
 def roll_window(r : np.array, len : int) -> np.array:
-    r0 = np.cumsum(r)
-    r_shift = np.roll(r0, len)
-    r_shift[0:len] = 0
-    r_len = r0 - r_shift
-    r_len = r_len[len-1:r_len.shape[0]]
-    return r_len
+    # sum over len consecutive returns, see rolling.rolling_sum
+    return rolling.rolling_sum(r, len)
 
 def test_roll_window():
     r = np.array([0.1, 0.1, 0.2, 0.2, 0.4, 0.6])
@@ -21,8 +21,7 @@ def test_roll_window():
 if __name__ == "__main__":
 
     TauIn = 1440#60
-    DF = pd.read_pickle("./Risk/XBTCHF_"+str(TauIn)+"_Processed_v3.pkl")
-    r_raw = DF["logRet"].to_numpy()
+    r_raw = np.asarray(candle_store.load_candles(TauIn, ["logRet"])["logRet"])
     # calculate rolling window 5 day returns
     num_days = 5
     r = roll_window(r_raw, num_days)
@@ -0,0 +1,10 @@
+# Risk analysis of Frankencoin positions, reserve and savings
+#
+# Importing the package or any of its modules has no side effects:
+# analyses only run from the command line, and matplotlib, scipy and
+# statsmodels are imported on first use (see _lazy.py).
+#
+#   python -m Risk <command> [args]     e.g. python -m Risk estimation
+#   python -m Risk --headless <command> no plot windows (Agg backend)
+#   python -m Risk import-time          import cost of every module
+#   python -m Risk --help               list of commands
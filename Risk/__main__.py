@@ -0,0 +1,110 @@
+# Command line entry point, python -m Risk <command>
+#
+# Every analysis command runs the __main__ block of one module of the
+# package, so only that module and its dependencies are imported.
+
+import argparse
+import os
+import runpy
+import subprocess
+import sys
+import warnings
+
+COMMANDS = {
+    "estimation": ("Estimation", "bootstrap liquidation probability and PnL curves"),
+    "expected-shortfall": ("expected_shortfall", "loss distribution, mean excess and GPD tail"),
+    "var": ("VaR", "unconditional VaR of 5-day returns"),
+    "var-backtest": ("var_backtest", "rolling VaR/ES backtest with exceedance tests"),
+    "loss-surface": ("loss_surface", "loss statistics on the (h', h, rateK, tau) grid"),
+    "gpd-tail": ("gpd_tail", "GPD tail fit with bootstrap ES intervals"),
+    "parameters": ("parameters", "minting premium under normal and Student-t returns"),
+    "bootstrap": ("bootstrap", "scaling of the block bootstrap with the number of workers"),
+    "auction-sim": ("auction_sim", "Monte-Carlo of MintingHub challenge auctions"),
+    "equity-sim": ("equity_sim", "Equity (FPS) issuance and redemption scenarios"),
+    "savings-sim": ("savings_sim", "Savings interest accrual and liability"),
+    "cubic-root": ("cubic_root", "differential test of the MathUtil._cubicRoot model"),
+    "candle-store": ("candle_store", "migrate and list the candle stores"),
+    "kraken-data": ("kraken_data", "fetch new Kraken candles into the store"),
+    "data-roller": ("data_roller", "Bitpanda data statistics and plots"),
+    "fetcher": ("fetcher", "replay the daily candles through the local fixture server"),
+    "trade-resampler": ("trade_resampler", "resample a trades csv to candles"),
+    "result-cache": ("result_cache", "exercise the result cache"),
+    "benchmark": ("benchmarks", "time the hot paths on synthetic data"),
+}
+HEAVY = ["matplotlib", "scipy", "statsmodels", "requests"]
+
+
+def _headless():
+    # non-interactive backend, plt.show() returns immediately
+    os.environ["MPLBACKEND"] = "Agg"
+    warnings.filterwarnings("ignore", message=".*non-interactive.*")
+
+def _run(module, args):
+    sys.argv = [f"{__package__}.{module}"] + args
+    runpy.run_module(f"{__package__}.{module}", run_name="__main__", alter_sys=True)
+
+def _import_time(module, repeat):
+    # best wall time of importing the module in a fresh interpreter and
+    # the heavy packages it pulled in
+    code = ("import sys, time; t0 = time.perf_counter(); import {m}; "
+            "dt = time.perf_counter() - t0; "
+            "print(dt, ','.join(h for h in {heavy!r} if h in sys.modules))")
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    best = None
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, "-c", code.format(m=module, heavy=HEAVY)],
+                             cwd=root, capture_output=True, text=True, check=True).stdout.split()
+        dt = float(out[0])
+        best = dt if best is None else min(best, dt)
+    return [best, out[1] if len(out) > 1 else ""]
+
+def import_time(repeat=3):
+    """
+    Import cost of every module of the package next to numpy/pandas and
+    the heavy dependencies, each in a fresh interpreter
+    """
+    rows = [("numpy, pandas", "numpy, pandas"),
+            ("matplotlib.pyplot, scipy.stats, statsmodels.api",
+             "matplotlib.pyplot, scipy.stats, statsmodels.api")]
+    rows += [(f"{__package__}.{m}", f"{__package__}.{m}") for m in sorted({m for (m, _) in COMMANDS.values()})]
+    print(f"{'module':50s} {'ms':>8s}  heavy modules loaded")
+    for (label, module) in rows:
+        [dt, heavy] = _import_time(module, repeat)
+        print(f"{label:50s} {1000*dt:8.1f}  {heavy}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog=f"python -m {__package__}",
+                                     description="Frankencoin risk analyses",
+                                     formatter_class=argparse.RawDescriptionHelpFormatter,
+                                     epilog="commands:\n" + "\n".join(
+                                         f"  {c:20s} {d}" for c, (_, d) in COMMANDS.items())
+                                     + "\n  import-time          import cost of every module")
+    parser.add_argument("--headless", action="store_true", help="no plot windows")
+    parser.add_argument("--cache", action="store_true",
+                        help="reuse results cached for unchanged data, parameters and code version")
+    parser.add_argument("--trace", metavar="FILE", default=None,
+                        help="record stage timings as Chrome trace-event JSON")
+    parser.add_argument("--trace-alloc", action="store_true",
+                        help="with --trace, also record the tracemalloc peak per stage")
+    parser.add_argument("command", choices=list(COMMANDS) + ["import-time"], metavar="command")
+    parser.add_argument("args", nargs=argparse.REMAINDER, help="arguments of the command")
+    args = parser.parse_args(argv)
+    if args.headless:
+        _headless()
+    if args.cache:
+        os.environ["RISK_CACHE"] = "1"
+    if args.trace:
+        from . import instrument
+        instrument.enable(args.trace, args.trace_alloc)
+    if args.command == "import-time":
+        import_time()
+    else:
+        _run(COMMANDS[args.command][0], args.args)
+    if args.trace:
+        instrument.save()
+        for name, seconds in instrument.summary():
+            print(f"{seconds:10.3f}s  {name}", file=sys.stderr)
+        print(f"trace written to {args.trace}", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,26 @@
+# Deferred import of heavy modules
+#
+# lazy("matplotlib.pyplot") returns a stand-in that imports the module
+# on first attribute access. Modules of this package bind matplotlib,
+# scipy and statsmodels this way, so importing them does not pay for
+# those packages unless a function actually uses them.
+
+import importlib
+
+
+class _LazyModule:
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<lazy module '{self._name}' ({state})>"
+
+def lazy(name):
+    return _LazyModule(name)
@@ -0,0 +1,163 @@
+# Monte-Carlo simulation of MintingHub challenge auctions
+#
+# A challenge runs in two phases of equal length `phase`
+# (MintingHub.bid): during the first phase anyone can avert the
+# challenge by buying the challenger's collateral at the liquidation
+# price; afterwards the price of the collateral falls linearly from the
+# liquidation price to zero over `phase` (_calculatePrice). The proceeds
+# of the winning bid are split by _finishChallenge: CHALLENGER_REWARD of
+# the offer goes to the challenger, the rest repays the position's debt,
+# any excess is shared between the system (reservePPM) and the owner,
+# and a shortfall is covered by the reserve (coverLoss). Burning the
+# repaid debt with burnWithoutReserve then releases its minter reserve,
+# reservePPM of the debt, into equity. The net loss of the system is the
+# covered shortfall less the released reserve and the excess share; it
+# assumes the minter reserve is fully funded.
+#
+# Market prices follow bootstrapped intraday paths: blocks of
+# consecutive hourly candles with their close, high and low returns.
+# Bidders arrive as soon as the auction price crosses the market high.
+# All paths of a parameter set are simulated at once.
+# Amounts are per unit of collateral and in units of the liquidation
+# price.
+
+from dataclasses import dataclass
+import numpy as np
+import pandas as pd
+from . import candle_store
+
+CHALLENGER_REWARD_PPM = 20_000
+
+
+def sample_paths(r, r_max, r_min, num_steps, num_paths, block_len=24, seed=None):
+    """
+    Bootstrapped intraday log-price paths
+    r, r_max, r_min : log-returns close, high and low over open per candle
+    num_steps : candles per path
+    num_paths : number of paths
+    block_len : consecutive candles per bootstrap block, wrapping around
+    return [level_high, level_low, level_close] (num_paths, num_steps) log-price
+           of each candle's high, low and close relative to the path start
+    """
+    rng = np.random.default_rng(seed)
+    K = r.shape[0]
+    num_blocks = -(-num_steps // block_len)
+    pivots = rng.integers(0, K, size=(num_paths, num_blocks, 1), dtype=np.int32)
+    idx = np.mod(pivots + np.arange(block_len, dtype=np.int32), K).reshape(num_paths, -1)[:, :num_steps]
+    close = np.cumsum(r[idx], 1)
+    level_open = close - r[idx]
+    return [level_open + r_max[idx], level_open + r_min[idx], close]
+
+@dataclass
+class AuctionResult:
+    """
+    Per path outcome of one parameter set, arrays of length num_paths
+    averted : challenge averted in phase 1
+    bid_time : hours after the challenge start at which the collateral was sold
+    offer : price paid by the bidder
+    challenger_reward : reward paid to the challenger
+    owner_recovery : excess funds paid out to the position owner
+    system_profit : reserve share of the excess funds (collectProfits)
+    cover_loss : shortfall covered by the reserve (coverLoss), gross
+    reserve_release : minter reserve of the repaid debt released into
+                      equity (burnWithoutReserve)
+    system_loss : net loss of equity, cover_loss - reserve_release -
+                  system_profit, negative for a gain
+    """
+    averted: np.ndarray
+    bid_time: np.ndarray
+    offer: np.ndarray
+    challenger_reward: np.ndarray
+    owner_recovery: np.ndarray
+    system_profit: np.ndarray
+    cover_loss: np.ndarray
+    reserve_release: np.ndarray
+    system_loss: np.ndarray
+
+def simulate_auction(level_high, h0, minted, reservePPM, phase, dt=1.0, bid_discount=0.0):
+    """
+    Run the challenge auction against market paths
+    level_high : (num_paths, >= 2*phase/dt) log high per candle, see sample_paths
+    h0 : market price / liquidation price - 1 at the challenge start
+    minted : debt of the position per unit of collateral / liquidation price
+    reservePPM : reserve contribution of the position
+    phase : length of each auction phase in hours
+    dt : candle time in hours
+    bid_discount : bidders only buy below market * (1 - bid_discount)
+    """
+    n1 = int(round(phase/dt))
+    high = (1+h0) * np.exp(level_high[:, :2*n1])
+    # phase 1: averted if the market trades above the liquidation price
+    averted = np.any(high[:, :n1] * (1-bid_discount) >= 1.0, 1)
+    # phase 2: auction price at the start and end of every candle
+    a_start = 1.0 - np.arange(n1) / n1
+    a_end = 1.0 - np.arange(1, n1+1) / n1
+    bid_limit = high[:, n1:] * (1-bid_discount)
+    crossed = bid_limit >= a_end
+    k = np.argmax(crossed, 1)
+    sold = np.any(crossed, 1)
+    # fill at the auction price when it reaches the market within the candle
+    fill = np.clip(bid_limit[np.arange(k.shape[0]), k], a_end[k], a_start[k])
+    offer = np.where(sold, fill, 0.0)
+    bid_time = np.where(sold, phase + (k+1)*dt, 2*phase)
+    reward = offer * CHALLENGER_REWARD_PPM / 1_000_000
+    funds = offer - reward
+    excess = np.maximum(funds - minted, 0.0)
+    profit = reservePPM / 1_000_000 * excess
+    cover_loss = np.maximum(minted - funds, 0.0)
+    release = np.full(offer.shape, reservePPM / 1_000_000 * minted)
+    result = AuctionResult(averted, np.where(averted, np.nan, bid_time),
+                           offer, reward, excess - profit, profit,
+                           cover_loss, release, cover_loss - release - profit)
+    for name in ["offer", "challenger_reward", "owner_recovery", "system_profit",
+                 "cover_loss", "reserve_release", "system_loss"]:
+        setattr(result, name, np.where(averted, 0.0, getattr(result, name)))
+    return result
+
+def simulate_grid(r, r_max, r_min, params, num_paths=1_000_000, chunk=100_000,
+                  dt=1.0, block_len=24, seed=None, levels=(0.5, 0.95, 0.99)):
+    """
+    Distribution of auction outcomes per parameter set
+    r, r_max, r_min : candle returns with candle time dt hours
+    params : DataFrame with columns h0, minted, reservePPM, phase (hours),
+             optional bid_discount
+    num_paths : number of paths, simulated chunk paths at a time and shared
+                by all parameter sets
+    return DataFrame with one row per parameter set: probability of averting,
+           mean and quantiles at levels of the net system loss, the gross
+           covered loss, challenger reward and owner recovery
+    """
+    params = params.reset_index(drop=True)
+    num_steps = int(round(2 * params["phase"].max() / dt))
+    stats = ["system_loss", "cover_loss", "challenger_reward", "owner_recovery"]
+    samples = {s: np.zeros((params.shape[0], num_paths)) for s in stats}
+    averted = np.zeros((params.shape[0], num_paths), dtype=bool)
+    seeds = np.random.SeedSequence(seed).spawn(-(-num_paths // chunk))
+    for j, ss in enumerate(seeds):
+        sel = slice(j*chunk, min((j+1)*chunk, num_paths))
+        [level_high, _, _] = sample_paths(r, r_max, r_min, num_steps, sel.stop - sel.start, block_len, ss)
+        for p, row in params.iterrows():
+            res = simulate_auction(level_high, row["h0"], row["minted"], row["reservePPM"],
+                                   row["phase"], dt, row.get("bid_discount", 0.0))
+            averted[p, sel] = res.averted
+            for s in stats:
+                samples[s][p, sel] = getattr(res, s)
+    out = params.copy()
+    out["prob_averted"] = np.mean(averted, 1)
+    for s in stats:
+        out[s + "_mean"] = np.mean(samples[s], 1)
+        for lvl in levels:
+            out[f"{s}_q{lvl:g}"] = np.quantile(samples[s], lvl, axis=1)
+    return out
+
+if __name__ == "__main__":
+    TauIn = 60
+    candles = candle_store.load_candles(TauIn, ["logRet", "maxRet", "minRet"])
+    [r, r_max, r_min] = [np.asarray(candles[c]) for c in ["logRet", "maxRet", "minRet"]]
+    params = pd.DataFrame([{"h0": h0, "minted": m, "reservePPM": 200_000, "phase": ph}
+                           for h0 in [-0.05, -0.02, 0.0]
+                           for m in [0.8, 1.0]
+                           for ph in [24, 72]])
+    res = simulate_grid(r, r_max, r_min, params, num_paths=100_000, seed=1)
+    with pd.option_context("display.max_columns", None, "display.width", 200):
+        print(res)
@@ -0,0 +1,196 @@
+# Benchmarks of the hot paths on synthetic data
+#
+# Returns are Student-t distributed (fat tails, df=3 by default) with
+# a max-return column above them, so every benchmark runs offline at
+# any size from 1k to 10M candles. Each case is timed repeat times
+# (minimum and median wall time), then run once more under tracemalloc
+# for the peak of the Python and NumPy allocations. Results are written
+# as JSON and can be compared against a stored baseline:
+#
+#   python -m Risk benchmark --sizes 1e3,1e5,1e6 --out bench.json
+#   python -m Risk benchmark --baseline bench.json --threshold 0.2
+#
+# The comparison fails (exit code 1) if the minimum time of a case grows
+# by more than the threshold; cases below 1ms are not compared.
+# Bootstrap matrices are limited to MAX_ELEMENTS entries,
+# B = MAX_ELEMENTS // n rows.
+
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+import numpy as np
+
+MAX_ELEMENTS = 2**24
+# module globals the cases set, restored after a run
+CASE_GLOBALS = {"Estimation": ["h", "rateK", "K"], "expected_shortfall": ["hDash"]}
+_MISSING = object()
+
+
+def synthetic_returns(n, df=3, scale=0.03, seed=0):
+    """
+    Fat-tailed candle returns
+    n : number of candles
+    df : degrees of freedom of the Student-t distribution
+    scale : standard deviation of the log-returns
+    return [logRet, maxRet], maxRet >= max(logRet, 0)
+    """
+    rng = np.random.default_rng(seed)
+    t_scale = scale / np.sqrt(df / (df-2))
+    r = t_scale * rng.standard_t(df, n)
+    r_max = np.maximum(r, 0) + 0.5 * t_scale * np.abs(rng.standard_t(df, n))
+    return [r, r_max]
+
+def _cases():
+    # name -> setup(n, r, r_max) returning the callable to time
+    from . import Estimation, VaR, expected_shortfall
+    h, rateK, tau, TauIn = 0.10, 0.02, 24, 60
+
+    def bootstrap_matrix(n, r, r_max):
+        B = max(1, MAX_ELEMENTS // n)
+        return lambda: Estimation.get_block_bootstrap_mtrx(r, tau, TauIn, B, seed=1)
+
+    def pnl(n, r, r_max):
+        B = max(1, MAX_ELEMENTS // n)
+        Rtau = Estimation.get_block_bootstrap_mtrx(r, tau, TauIn, B, seed=1)
+        RtauMax = Estimation.get_block_bootstrap_mtrx(r_max, tau, TauIn, B, seed=1)
+        Estimation.h, Estimation.rateK, Estimation.K = h, rateK, Rtau.shape[1]
+        return lambda: Estimation.calc_pnl(0.05, Rtau, RtauMax)
+
+    def overlapping(n, r, r_max):
+        return lambda: expected_shortfall.construct_overlapping_returns(r, TauIn, tau*60)
+
+    def roll(n, r, r_max):
+        return lambda: VaR.roll_window(r, tau)
+
+    def eme(n, r, r_max):
+        return lambda: expected_shortfall.mean_excess_function(-r)
+
+    def plot_eme(n, r, r_max):
+        expected_shortfall.hDash = 0.05
+
+        def run():
+            expected_shortfall.plot_eme(-r, u_start=0)
+            expected_shortfall.plt.close("all")
+        return run
+
+    return {"get_block_bootstrap_mtrx": bootstrap_matrix,
+            "calc_pnl": pnl,
+            "construct_overlapping_returns": overlapping,
+            "roll_window": roll,
+            "mean_excess_function": eme,
+            "plot_eme": plot_eme}
+
+@contextlib.contextmanager
+def _restore_globals(names):
+    # put back (or delete) module globals after the block
+    import importlib
+    saved = []
+    for mod, attrs in names.items():
+        m = importlib.import_module(f"{__package__}.{mod}")
+        saved += [(m, a, vars(m).get(a, _MISSING)) for a in attrs]
+    try:
+        yield
+    finally:
+        for (m, a, v) in saved:
+            if v is _MISSING:
+                vars(m).pop(a, None)
+            else:
+                setattr(m, a, v)
+
+def run(sizes, repeat=5, only=None, seed=0):
+    """
+    Time every case at every size
+    sizes : numbers of candles
+    repeat : timed runs per case
+    only : names of the cases to run, all by default
+    return dict with "meta" and "results", one entry per case and size
+    """
+    # plots are rendered but never shown
+    os.environ.setdefault("MPLBACKEND", "Agg")
+    with _restore_globals(CASE_GLOBALS):
+        results = _run_cases(_cases(), sizes, repeat, only, seed)
+    meta = {"date": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "python": sys.version.split()[0], "numpy": np.__version__,
+            "platform": platform.platform(), "cpus": os.cpu_count()}
+    return {"meta": meta, "results": results}
+
+def _run_cases(cases, sizes, repeat, only, seed):
+    results = []
+    for n in sizes:
+        [r, r_max] = synthetic_returns(int(n), seed=seed)
+        for name, setup in cases.items():
+            if only and name not in only:
+                continue
+            fn = setup(int(n), r, r_max)
+            fn()
+            times = []
+            for _ in range(repeat):
+                t0 = time.perf_counter()
+                fn()
+                times.append(time.perf_counter() - t0)
+            tracemalloc.start()
+            fn()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            results.append({"name": name, "n": int(n), "repeat": repeat,
+                            "min_s": min(times), "median_s": float(np.median(times)),
+                            "peak_bytes": peak})
+            print(f"{name:30s} n={int(n):>10d} min={1000*min(times):10.2f}ms "
+                  f"median={1000*float(np.median(times)):10.2f}ms peak={peak/2**20:9.1f}MB")
+    return results
+
+def compare(current, baseline, threshold=0.2, min_seconds=1e-3):
+    """
+    Cases slower than the baseline by more than threshold (relative, on
+    the minimum time); cases missing in the baseline or faster than
+    min_seconds in both runs are skipped as timer noise
+    return list of dicts with name, n, baseline_s, current_s, ratio
+    """
+    base = {(b["name"], b["n"]): b for b in baseline["results"]}
+    regressions = []
+    for c in current["results"]:
+        b = base.get((c["name"], c["n"]))
+        if b is None or max(b["min_s"], c["min_s"]) < min_seconds:
+            continue
+        ratio = c["min_s"] / b["min_s"]
+        if ratio > 1 + threshold:
+            regressions.append({"name": c["name"], "n": c["n"], "baseline_s": b["min_s"],
+                                "current_s": c["min_s"], "ratio": ratio})
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="benchmark the Risk hot paths")
+    parser.add_argument("--sizes", default="1e3,1e5,1e6",
+                        help="comma separated numbers of candles, up to 1e7")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--only", default=None, help="comma separated case names")
+    parser.add_argument("--out", default=None, help="write results as JSON")
+    parser.add_argument("--baseline", default=None, help="JSON results to compare with")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="allowed relative slowdown before failing")
+    args = parser.parse_args(argv)
+    sizes = [int(float(s)) for s in args.sizes.split(",")]
+    only = args.only.split(",") if args.only else None
+    res = run(sizes, args.repeat, only)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(res, f, indent=1)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(res, baseline, args.threshold)
+        for g in regressions:
+            print(f"REGRESSION {g['name']} n={g['n']}: {1000*g['baseline_s']:.2f}ms -> "
+                  f"{1000*g['current_s']:.2f}ms ({g['ratio']:.2f}x)")
+        if regressions:
+            sys.exit(1)
+        print(f"no regression beyond {args.threshold:.0%}")
+
+if __name__ == "__main__":
+    main()
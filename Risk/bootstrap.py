@@ -0,0 +1,266 @@
+# Block bootstrap engine for tau-period log-returns
+#
+# All pivots of a bootstrap matrix are drawn at once from a seeded
+# numpy Generator. The sum over a block of consecutive returns is read
+# from a prefix sum of the wrapped return series instead of being
+# summed element by element.
+#
+# The B replications are split into fixed-size batches and every batch
+# draws from its own stream spawned off one SeedSequence, so results do
+# not depend on how batches are grouped. A full bootstrap matrix has to
+# be gathered in one process anyway and is drawn serially. Parallel work
+# goes through bootstrap_moments: every worker draws, gathers and
+# reduces its batches to the moments of a per-replication statistic,
+# and only those are sent back.
+#
+# A bootstrap sample is stored as its int32 block pivots only. Every
+# column of the candle data (logRet, maxRet, ...) is derived from the
+# same pivots on demand, so the columns of one replication are paired
+# and sampling is paid once.
+#
+# The intraday (hierarchical) bootstrap samples blocks of whole days
+# and builds each tau-hour path from their intraday candles. Close
+# return and running maximum of every day block are computed once from
+# the intraday candles (rolling.rolling_path_max), so a path of one
+# block costs a lookup as in the daily bootstrap. Paths can also be put
+# together from several independently sampled blocks; they then need
+# the cumulative sum and running maximum over their (B, K, steps) tile.
+
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from . import instrument
+from . import rolling
+
+# replications per independent random stream
+BATCH_SIZE = 1_000
+
+
+def block_length(tau, TauIn):
+    # number of consecutive TauIn-minute candles that make up
+    # a period of tau hours
+    return int(tau/TauIn*60)
+
+def wrapped_block_sums(rvec, num_returns):
+    # S[p] = sum of num_returns consecutive returns starting at p, wrapping
+    # around the end of rvec, i.e. np.sum(rvec[np.mod(p + np.arange(num_returns), K)]).
+    # Blocks longer than the series wrap around more than once.
+    return rolling.rolling_sum(rvec, num_returns, wrap=True)
+
+def draw_pivots(rng, B, K):
+    # B bootstrap samples with K uniformly drawn block starts each
+    return rng.integers(0, K, size=(B, K), dtype=np.int32)
+
+def batch_seeds(seed, B, batch_size=BATCH_SIZE):
+    # one child SeedSequence and row count per batch of replications
+    num_batches = -(-B // batch_size)
+    children = np.random.SeedSequence(seed).spawn(num_batches)
+    rows = [min(batch_size, B - j*batch_size) for j in range(num_batches)]
+    return list(zip(children, rows))
+
+def _pivot_batch(K, seed_seq, rows):
+    # worker: block pivots of one batch from its own stream
+    return draw_pivots(np.random.default_rng(seed_seq), rows, K)
+
+class BlockBootstrapSample:
+    """
+    Block bootstrap sample stored as block pivots only
+    pivots : (B, K) int32 matrix of block starts
+    num_returns : number of consecutive returns that form one block
+    """
+    def __init__(self, pivots, num_returns):
+        self.pivots = pivots
+        self.num_returns = num_returns
+
+    @property
+    def shape(self):
+        return self.pivots.shape
+
+    def column(self, rvec, rows=slice(None)):
+        # block sums of rvec for the selected replications, e.g.
+        # Rtau = column(logRet), RtauMax = column(maxRet)
+        S = wrapped_block_sums(rvec, self.num_returns)
+        return S[self.pivots[rows]]
+
+def sample_pivots(K, num_returns, B, seed=None, batch_size=BATCH_SIZE):
+    """
+    Draw a paired block bootstrap sample
+    K : length of the return series
+    num_returns : number of consecutive returns that form one block
+    B : number of bootstrap samples (rows)
+    seed : seed for numpy.random.SeedSequence, same seed gives same sample
+    batch_size : replications per random stream
+    """
+    if B < 1:
+        raise ValueError(f"B={B}, at least one bootstrap sample is needed")
+    batches = batch_seeds(seed, B, batch_size)
+    with instrument.stage("bootstrap pivots", replications=B):
+        parts = [_pivot_batch(K, ss, rows) for ss, rows in batches]
+    return BlockBootstrapSample(np.concatenate(parts, axis=0), num_returns)
+
+def block_bootstrap(rvec, num_returns, B, seed=None, batch_size=BATCH_SIZE):
+    """
+    Matrix of block bootstrapped returns
+    rvec : vector of returns
+    num_returns : number of consecutive returns that form one block
+    B : number of bootstrap samples (rows)
+    seed : seed for numpy.random.SeedSequence, same seed gives same matrix
+    batch_size : replications per random stream
+    return (B, K) matrix with K = rvec.shape[0]
+    """
+    sample = sample_pivots(rvec.shape[0], num_returns, B, seed, batch_size)
+    return sample.column(rvec)
+
+def _moments_batch(S_cols, stat, seed_seq, rows):
+    # worker: draw, gather and reduce one batch; only the moments travel back
+    pivots = _pivot_batch(S_cols[0].shape[0], seed_seq, rows)
+    X = stat(*[S[pivots] for S in S_cols])
+    mean_b = np.mean(X, 0)
+    return [rows, mean_b, np.sum((X - mean_b)**2, 0)]
+
+def bootstrap_moments(rvecs, num_returns, B, stat, shape, seed=None, workers=1,
+                      batch_size=BATCH_SIZE):
+    """
+    Moments of a per-replication statistic of a paired block bootstrap
+    without keeping the sample
+    rvecs : return vectors of equal length, e.g. [logRet, maxRet], sampled
+            with the same pivots
+    num_returns : number of consecutive returns that form one block
+    B : number of bootstrap samples
+    stat : (R_1, ..., R_m) -> (rows, *shape) with R_i the (rows, K) block
+           sums of rvecs[i]; module level function or functools.partial
+           for workers > 1
+    shape : shape of the statistic of one replication
+    seed : seed for numpy.random.SeedSequence, same seed and batch_size give
+           the same result for any number of workers
+    workers : number of processes
+    return RunningMoments over the B replications
+    """
+    if B < 1:
+        raise ValueError(f"B={B}, at least one bootstrap sample is needed")
+    S_cols = [wrapped_block_sums(r, num_returns) for r in rvecs]
+    batches = batch_seeds(seed, B, batch_size)
+    args = [[S_cols]*len(batches), [stat]*len(batches),
+            [ss for ss, _ in batches], [rows for _, rows in batches]]
+    moments = RunningMoments(shape)
+    if workers <= 1:
+        for part in map(_moments_batch, *args):
+            moments.merge(*part)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for part in pool.map(_moments_batch, *args):
+                moments.merge(*part)
+    return moments
+
+class RunningMoments:
+    # count, mean and sum of squared deviations of per-replication statistics,
+    # updated batch by batch so that replications need not be kept
+    # (pairwise update of Chan, Golub and LeVeque)
+    def __init__(self, shape):
+        self.n = 0
+        self.mean = np.zeros(shape)
+        self.m2 = np.zeros(shape)
+
+    def add(self, x):
+        # x: (rows, *shape) statistics of one batch of replications
+        mean_b = np.mean(x, 0)
+        self.merge(x.shape[0], mean_b, np.sum((x - mean_b)**2, 0))
+
+    def merge(self, n_b, mean_b, m2_b):
+        n = self.n + n_b
+        delta = mean_b - self.mean
+        self.mean = self.mean + delta * n_b / n
+        self.m2 = self.m2 + m2_b + delta**2 * self.n * n_b / n
+        self.n = n
+
+    def var(self):
+        # population variance, as np.var
+        return self.m2 / self.n
+
+def intraday_grid(timestamp, r, r_max, TauIn, max_missing=0.1):
+    """
+    Intraday candles on a complete grid of whole UTC days
+    timestamp : sorted candle open times in seconds
+    r, r_max : log-returns close/open and high/open per candle
+    TauIn : candle time in minutes
+    max_missing : largest fraction of missing candles that is filled
+    return [r, r_max, per_day, report], missing candles (no trades) are
+           flat, i.e. zero returns, and the grid starts at midnight;
+           report is the data_roller.GapReport of the timestamps
+    """
+    from . import data_roller
+    report = data_roller.gap_report(timestamp, TauIn)
+    if report.duplicates.shape[0] > 0:
+        raise ValueError(f"{report.duplicates.shape[0]} duplicate timestamps, "
+                         f"first at {report.duplicates['timestamp'].iloc[0]}")
+    if report.missing_ratio > max_missing:
+        raise ValueError(f"{report.missing_ratio:.1%} of the candles are missing, "
+                         f"more than max_missing={max_missing:.1%}")
+    per_day = 1440 // TauIn
+    ts = np.asarray(timestamp, dtype=np.int64)
+    slot = (ts - ts[0] // 86400 * 86400) // (TauIn*60)
+    if np.any(np.diff(slot) <= 0):
+        raise ValueError("timestamps are not sorted or not on the candle grid")
+    num_days = int(slot[-1]) // per_day + 1
+    r_grid = np.zeros(num_days*per_day)
+    r_max_grid = np.zeros(num_days*per_day)
+    r_grid[slot] = r
+    r_max_grid[slot] = r_max
+    return [r_grid, r_max_grid, per_day, report]
+
+def day_block_stats(r, r_max, per_day, block_days=1):
+    """
+    Close return and path maximum of every day block
+    r, r_max : intraday returns on a grid of whole days, see intraday_grid
+    per_day : candles per day
+    block_days : days per block, blocks start at every midnight and wrap
+                 around the end of the series
+    return [S, M], S[d] the log-return over the block starting on day d and
+           M[d] the running maximum of the cumulative path within it
+    """
+    m = per_day * block_days
+    S = rolling.rolling_sum(r, m, wrap=True)[::per_day]
+    M = rolling.rolling_path_max(r, r_max, m, wrap=True)[::per_day]
+    return [S, M]
+
+def path_stats(S, M, pivots):
+    """
+    Close return and running maximum of paths made of several blocks
+    S, M : per-block close return and path maximum, see day_block_stats
+    pivots : (rows, K, steps) block starts, the steps blocks of one path
+             are chained in this order; steps=1 is one contiguous block
+    return [Rtau, RtauMax], each (rows, K)
+    """
+    s = S[pivots]
+    level = np.cumsum(s, 2)
+    # level before each block plus the high within it; only the maximum
+    # over the whole path enters D, so the running maximum is not kept
+    high = level - s + M[pivots]
+    return [level[..., -1], np.max(high, 2)]
+
+def _path_pivot_batch(K, steps, seed_seq, rows):
+    # worker: block starts of one batch, steps blocks per path
+    return np.random.default_rng(seed_seq).integers(0, K, size=(rows, K, steps), dtype=np.int32)
+
+def _mean_and_tail(R):
+    # per-replication mean and 1% quantile, statistic of benchmark_scaling
+    return np.stack([np.mean(R, 1), np.quantile(R, 0.01, axis=1)], 1)
+
+def benchmark_scaling(rvec, num_returns, B, max_workers, seed=0):
+    # replications per second of bootstrap_moments for 1..max_workers processes
+    res = np.zeros((max_workers, 2))
+    for w in range(1, max_workers+1):
+        t0 = time.perf_counter()
+        bootstrap_moments([rvec], num_returns, B, _mean_and_tail, (2,), seed, workers=w)
+        dt = time.perf_counter() - t0
+        res[w-1, :] = [w, B/dt]
+        print(f"workers={w}: {B/dt:,.0f} replications/s")
+    return res
+
+if __name__ == "__main__":
+    import os
+    from . import candle_store
+    TauIn = 1440#60
+    r = np.asarray(candle_store.load_candles(TauIn, ["logRet"])["logRet"])
+    tau = 24
+    benchmark_scaling(r, block_length(tau, TauIn), 20_000, os.cpu_count())
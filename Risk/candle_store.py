@@ -0,0 +1,192 @@
+# Columnar on-disk candle store
+#
+# One store per (pair, interval) is a folder <pair>_<interval> holding
+# a raw little-endian file per column and a manifest.json with the
+# number of rows and the column dtypes. Columns are opened with
+# np.memmap, so reading logRet and maxRet only touches those files.
+# Appending writes the new bytes at the end of each column file and
+# then replaces the manifest; bytes beyond the manifest's row count
+# (e.g. from an interrupted append) are ignored and cut off on the
+# next append.
+#
+# load_candles migrates the existing XBTCHF_<TauIn>*.pkl or .csv file
+# into the store on first use.
+
+import glob
+import json
+import os
+import re
+import numpy as np
+import pandas as pd
+from . import instrument
+
+RISK_DIR = os.path.dirname(os.path.abspath(__file__))
+STORE_ROOT = os.path.join(RISK_DIR, "store")
+CSV_COLUMNS = ["timestamp", "open", "high", "low", "close", "volume", "trades"]
+
+
+def derived_columns(open_, high, low, close):
+    # log-returns of close, high and low relative to the open of each candle
+    log_open = np.log(open_)
+    return {"logRet": np.log(close) - log_open,
+            "maxRet": np.log(high) - log_open,
+            "minRet": np.log(low) - log_open}
+
+class CandleStore:
+    def __init__(self, pair, interval, root=STORE_ROOT):
+        self.pair = pair
+        self.interval = int(interval)
+        self.path = os.path.join(root, f"{pair}_{self.interval}")
+        self._manifest = None
+
+    def _manifest_path(self):
+        return os.path.join(self.path, "manifest.json")
+
+    def _column_path(self, name):
+        return os.path.join(self.path, name + ".bin")
+
+    def exists(self):
+        return os.path.exists(self._manifest_path())
+
+    @property
+    def manifest(self):
+        if self._manifest is None:
+            if self.exists():
+                with open(self._manifest_path()) as f:
+                    self._manifest = json.load(f)
+            else:
+                self._manifest = {"pair": self.pair, "interval": self.interval,
+                                  "rows": 0, "columns": {}}
+        return self._manifest
+
+    @property
+    def rows(self):
+        return self.manifest["rows"]
+
+    @property
+    def columns(self):
+        return list(self.manifest["columns"])
+
+    def column(self, name):
+        # read-only memory map of one column
+        dtype = np.dtype(self.manifest["columns"][name])
+        if self.rows == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(self._column_path(name), dtype=dtype, mode="r", shape=(self.rows,))
+
+    def load(self, columns=None):
+        # {name: memmap} for the requested columns, all by default
+        return {c: self.column(c) for c in (columns or self.columns)}
+
+    def to_frame(self, columns=None):
+        return pd.DataFrame({c: np.asarray(v) for c, v in self.load(columns).items()})
+
+    def last_timestamp(self):
+        # high-water mark of the store, None if empty
+        if self.rows == 0:
+            return None
+        return int(self.column("timestamp")[-1])
+
+    def _write_manifest(self):
+        tmp = self._manifest_path() + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.manifest, f, indent=1)
+        os.replace(tmp, self._manifest_path())
+
+    def append(self, data):
+        """
+        Append rows to every column
+        data : DataFrame or {name: array} with the same columns as the store,
+               any numeric columns if the store is empty
+        """
+        data = {c: np.asarray(data[c]) for c in data.keys()}
+        num_rows = {v.shape[0] for v in data.values()}
+        if len(num_rows) != 1:
+            raise ValueError("columns differ in length")
+        num_rows = num_rows.pop()
+        columns = self.manifest["columns"]
+        if self.rows == 0 and len(columns) == 0:
+            for c, v in data.items():
+                columns[c] = v.dtype.newbyteorder("<").str
+        elif set(data) != set(columns):
+            raise ValueError(f"columns {sorted(data)} do not match store {sorted(columns)}")
+        os.makedirs(self.path, exist_ok=True)
+        for c, dtype in columns.items():
+            dtype = np.dtype(dtype)
+            with open(self._column_path(c), "ab") as f:
+                f.truncate(self.rows * dtype.itemsize)
+                f.seek(0, os.SEEK_END)
+                f.write(np.ascontiguousarray(data[c], dtype=dtype).tobytes())
+        self.manifest["rows"] = self.rows + num_rows
+        self._write_manifest()
+
+    def write(self, data):
+        # replace the content of the store
+        for c in self.columns:
+            os.remove(self._column_path(c))
+        self._manifest = {"pair": self.pair, "interval": self.interval, "rows": 0, "columns": {}}
+        self.append(data)
+
+
+def _numeric_columns(DF):
+    # candle columns of a processed DataFrame with the derived returns
+    data = {c: DF[c].to_numpy() for c in DF.columns
+            if np.issubdtype(DF[c].dtype, np.number)}
+    if all(c in data for c in ["open", "high", "low", "close"]):
+        derived = derived_columns(data["open"], data["high"], data["low"], data["close"])
+        for c, v in derived.items():
+            data.setdefault(c, v)
+    return data
+
+def migrate_pickle(path, pair, interval, root=STORE_ROOT):
+    # copy a processed pickle (e.g. XBTCHF_1440_Processed_v3.pkl) into the store
+    store = CandleStore(pair, interval, root)
+    store.write(_numeric_columns(pd.read_pickle(path)))
+    return store
+
+def migrate_csv(path, pair, interval, root=STORE_ROOT):
+    # copy a Kraken OHLCVT csv (e.g. XBTCHF_1440.csv) into the store
+    DF = pd.read_csv(path, header=None, names=CSV_COLUMNS)
+    store = CandleStore(pair, interval, root)
+    store.write(_numeric_columns(DF))
+    return store
+
+def _legacy_file(pair, interval):
+    # newest processed pickle, or the csv
+    pickles = glob.glob(os.path.join(RISK_DIR, f"{pair}_{interval}_Processed*.pkl"))
+    if len(pickles) > 0:
+        def version(p):
+            m = re.search(r"_v(\d+)\.pkl$", p)
+            return int(m.group(1)) if m else 1
+        return max(pickles, key=version)
+    csv = os.path.join(RISK_DIR, f"{pair}_{interval}.csv")
+    return csv if os.path.exists(csv) else None
+
+def open_store(TauIn, pair="XBTCHF", root=STORE_ROOT):
+    # store for candle time TauIn, migrated from the legacy files if needed
+    store = CandleStore(pair, TauIn, root)
+    if not store.exists():
+        legacy = _legacy_file(pair, TauIn)
+        if legacy is None:
+            raise FileNotFoundError(f"no candle data for {pair} {TauIn}")
+        print("migrating", legacy, "to", store.path)
+        if legacy.endswith(".pkl"):
+            store = migrate_pickle(legacy, pair, TauIn, root)
+        else:
+            store = migrate_csv(legacy, pair, TauIn, root)
+    return store
+
+def load_candles(TauIn, columns=None, pair="XBTCHF", root=STORE_ROOT):
+    """
+    Memory-mapped candle columns
+    TauIn : candle time in minutes
+    columns : e.g. ["logRet", "maxRet"], all columns by default
+    return {name: read-only np.memmap}
+    """
+    with instrument.stage("load candles"):
+        return open_store(TauIn, pair, root).load(columns)
+
+if __name__ == "__main__":
+    for TauIn in [1440, 60]:
+        store = open_store(TauIn)
+        print(store.path, store.rows, "rows", store.columns)
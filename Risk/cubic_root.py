@@ -39,6 +39,120 @@ def halley(a):
     print("iterations = ", num_it)
     return x
 
+# Exact model of contracts/utils/MathUtil.sol
+#
+# Values are Python integers, batches are numpy object arrays so that
+# every operation uses exact integer arithmetic with the contract's
+# truncating division. Intermediates beyond uint256 are flagged, the
+# contract reverts on them.
+
+ONE_DEC18 = 10**18
+THRESH_DEC18 = 10**6
+UINT256_MAX = 2**256 - 1
+
+def mulD18_exact(a, b):
+    return (a * b) // ONE_DEC18
+
+def divD18_exact(a, b):
+    return (a * ONE_DEC18) // b
+
+def power3_exact(x):
+    return mulD18_exact(mulD18_exact(x, x), x)
+
+def _as_int_array(v):
+    return np.array([int(x) for x in np.ravel(v)], dtype=object)
+
+def guess_contract(v):
+    # initial guess of MathUtil._cubicRoot
+    in_range = (v > ONE_DEC18) & (v < 10**19)
+    return np.where(in_range, (v - ONE_DEC18) // 3 + ONE_DEC18, ONE_DEC18)
+
+def guess_bitlength(v):
+    # power of two close to the cube root of v*1e36
+    num_bits = np.frompyfunc(int.bit_length, 1, 1)(v * ONE_DEC18**2)
+    return np.frompyfunc(lambda b: 1 << max(b // 3, 0), 1, 1)(num_bits).astype(object)
+
+def cubic_root_exact(v, guess=guess_contract):
+    """
+    Batched MathUtil._cubicRoot with exact uint256 arithmetic
+    v : int or array of ints, 18 decimals
+    guess : initial value x0 as function of the object array v
+    return [x, num_it, reverted] arrays: root with 18 decimals, number of
+           Halley iterations and whether the contract reverts (overflow or
+           division by zero)
+    """
+    v = _as_int_array(v)
+    n = v.shape[0]
+    x = np.array(guess(v), dtype=object)
+    num_it = np.zeros(n, dtype=np.int64)
+    reverted = np.zeros(n, dtype=bool)
+    active = np.ones(n, dtype=bool)
+    while np.any(active):
+        idx = np.flatnonzero(active)
+        xa = x[idx]
+        va = v[idx]
+        xx = xa * xa
+        xx_d = xx // ONE_DEC18
+        xxx = xx_d * xa
+        powX3 = xxx // ONE_DEC18
+        num = powX3 + 2 * va
+        den = 2 * powX3 + va
+        prod = xa * num
+        fail = ((xx > UINT256_MAX) | (xxx > UINT256_MAX) | (2 * va > UINT256_MAX)
+                | (num > UINT256_MAX) | (den > UINT256_MAX) | (prod > UINT256_MAX)
+                | (den == 0)).astype(bool)
+        den = np.where(fail, 1, den)
+        xnew = prod // den
+        diff = np.abs(xnew - xa)
+        num_it[idx] += 1
+        x[idx] = xnew
+        reverted[idx] = fail
+        done = fail | (diff <= THRESH_DEC18).astype(bool)
+        active[idx[done]] = False
+    return [x, num_it, reverted]
+
+def icbrt(n):
+    # floor of the cube root of non-negative integers, object array
+    n = _as_int_array(n)
+    bits = np.frompyfunc(int.bit_length, 1, 1)(n)
+    x = np.frompyfunc(lambda b: 1 << (-(-b // 3)), 1, 1)(bits).astype(object)
+    while True:
+        # Newton from above decreases monotonically to the floor;
+        # x only reaches 0 for n = 0, where the quotient is 0 as well
+        y = (2 * x + n // np.maximum(x * x, 1)) // 3
+        smaller = (y < x).astype(bool)
+        if not np.any(smaller):
+            return x
+        x = np.where(smaller, y, x)
+
+def sample_uint256(num, seed=None):
+    # log-uniform over the bit length 1..256
+    rng = np.random.default_rng(seed)
+    words = rng.integers(0, 2**64, size=(num, 4), dtype=np.uint64).astype(object)
+    v = words[:, 0] | (words[:, 1] << 64) | (words[:, 2] << 128) | (words[:, 3] << 192)
+    shift = (256 - rng.integers(1, 257, size=num)).astype(object)
+    return v >> shift
+
+def differential_test(v, guess=guess_contract):
+    """
+    Compare cubic_root_exact against the exact cube root
+    v : array of inputs, 18 decimals
+    return dict with max absolute error (1e-18 units), max relative error,
+           iteration histogram (index = number of iterations),
+           mean iterations and number of reverting inputs
+    """
+    [x, num_it, reverted] = cubic_root_exact(v, guess)
+    v = _as_int_array(v)
+    ok = ~reverted
+    ref = icbrt(v[ok] * ONE_DEC18**2)
+    err = np.abs(x[ok] - ref)
+    rel = np.array([float(e) / float(max(r, 1)) for e, r in zip(err, ref)])
+    return {"max_abs_error": int(np.max(err)) if err.shape[0] else 0,
+            "max_rel_error": float(np.max(rel)) if rel.shape[0] else 0.0,
+            "iterations": np.bincount(num_it[ok]),
+            "mean_iterations": float(np.mean(num_it[ok])) if np.any(ok) else 0.0,
+            "reverted": int(np.sum(reverted))}
+
 def limit(min, minted, limit):
     reduction = (limit - minted - min)/2
     #limit = limit - reduction # old
@@ -63,4 +177,15 @@ if __name__=="__main__":
     a_hatD18 = halleyD18(v18)
     print(f"{a_hatD18:1f}={a_hatD18/1e18:0.14f}")
     v18hat = mulD18(a_hatD18, mulD18(a_hatD18, a_hatD18))
-    print(f"v18 = {v18hat/1e18:0.14f}")
\ No newline at end of file
+    print(f"v18 = {v18hat/1e18:0.14f}")
+
+    # differential test of the exact port: whole uint256 range and the
+    # range of Equity.invest, (capital + investment) / capital
+    inputs = {"uint256": sample_uint256(100_000, seed=1),
+              "invest": _as_int_array(np.random.default_rng(2).integers(ONE_DEC18, 10*ONE_DEC18, 100_000, dtype=np.uint64))}
+    for name, vs in inputs.items():
+        for gname, g in [("contract", guess_contract), ("bitlength", guess_bitlength)]:
+            res = differential_test(vs, g)
+            print(f"{name:8s} guess={gname:9s} max err={res['max_abs_error']} "
+                  f"rel={res['max_rel_error']:.2e} mean it={res['mean_iterations']:.2f} "
+                  f"reverted={res['reverted']} it histogram={res['iterations'].tolist()}")
\ No newline at end of file
@@ -1,19 +1,16 @@
 # Taps into API of bitpanda and analyses data
 # Conclusion: data not useful (cumulative log return are far from the overall return of the BTCHF price levels)
 import datetime
-from math import dist
-from socketserver import ForkingUDPServer
-import requests
+from dataclasses import dataclass
 import json
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-from scipy import stats
-import statsmodels.api as sm
-from statsmodels.tsa.stattools import adfuller
-from statsmodels.graphics.tsaplots import plot_acf
-from statsmodels.formula.api import ols
-from statsmodels.stats.stattools import durbin_watson
+from . import fetcher
+from ._lazy import lazy
+
+plt = lazy("matplotlib.pyplot")
+stats = lazy("scipy.stats")
+sm = lazy("statsmodels.api")
 
 #https://api.kraken.com/0/public/OHLC?interval=60&since=1589281199&pair=XBTCHF <-- too short
 #https://api.exchange.bitpanda.com/public/v1/candlesticks/BTC_CHF?unit=HOURS&period=1&from=2020-10-03T04%3A59%3A59.999Z&to=2020-12-03T07%3A59%3A59.999Z
@@ -29,42 +26,94 @@ def construct_query(t0, t1):
     return base+sT0+sT1
 
 def update_data(response, DF):
-    response._content
+    # single response; poll_data collects all pages with fetcher.fetch
     a_json = json.loads(response._content)
-    df = pd.DataFrame.from_dict(a_json)
+    df = fetcher.bitpanda_source().parse(a_json)
     if len(df) == 0:
         print("response empty")
         return DF
-    # timestamp in seconds
-    df['timestamp'] = df['time'].apply(lambda x: int(pd.Timestamp(x).value/1e9))
-    sHeaders = ['close', 'open', 'low', 'high', 'total_amount', 'volume']
-    for s in sHeaders:
-        df[s] = pd.to_numeric(df[s])
-    return DF.append(df)
+    return pd.concat([DF, df])
 
-def analyze_gaps(DF, tauInMin=60):
+@dataclass
+class GapReport:
+    """
+    Gaps and duplicates of a candle series
+    missing_ratio : missing / expected candles between first and last timestamp
+    months : per calendar month (UTC) with data: month, first, last, expected,
+             present, missing_ratio; expected counts the grid from the first
+             to the last candle within the month
+    gaps : runs of missing candles, start timestamp and length in candles
+    duplicates : timestamps occurring more than once and their count
+    """
+    missing_ratio: float
+    months: pd.DataFrame
+    gaps: pd.DataFrame
+    duplicates: pd.DataFrame
+
+def gap_report(timestamps, tauInMin=60) -> GapReport:
+    # one vectorized pass over integer timestamps: np.diff for gaps and
+    # duplicates, bincount over month buckets for the monthly ratios
     tauInSec = 60*tauInMin
-    print("#duplicates=", sum(DF['timestamp'].duplicated()))
-    ts_start = np.min(DF["timestamp"])
-    ts_end = np.max(DF["timestamp"])
-    timestamp_expected = np.arange(ts_start, ts_end+1, tauInSec)
-    timestamp_missing = np.setdiff1d(timestamp_expected, DF["timestamp"])
-    print("Missing ", len(timestamp_missing)/len(timestamp_expected))
-    DF["Y-MM"] = DF['timestamp'].apply(lambda x: datetime.datetime.utcfromtimestamp(x).strftime('%Y-%m'))
-    YM = DF["Y-MM"].drop_duplicates().to_numpy()
-    missing_ratio = np.zeros(YM.shape) 
-    for k in range(YM.shape[0]):
-        df_ts_curr = DF["timestamp"][DF["Y-MM"]==YM[k]]
-        ts_start = np.min(df_ts_curr)
-        ts_end = np.max(df_ts_curr)
-        timestamp_expected = np.arange(ts_start, ts_end+1, tauInSec)
-        timestamp_missing = np.setdiff1d(timestamp_expected, df_ts_curr)
-        missing_ratio[k] = len(timestamp_missing)/len(timestamp_expected)
-    plt.bar(YM, missing_ratio)
+    ts = np.sort(np.asarray(timestamps, dtype=np.int64))
+    if ts.shape[0] == 0:
+        return GapReport(0.0,
+                         pd.DataFrame(columns=["month", "first", "last", "expected",
+                                               "present", "missing_ratio"]),
+                         pd.DataFrame({"start": ts, "length": ts}),
+                         pd.DataFrame({"timestamp": ts, "count": ts}))
+    is_dup = np.concatenate(([False], np.diff(ts) == 0))
+    [dup_ts, dup_cnt] = np.unique(ts[is_dup], return_counts=True)
+    ts = ts[~is_dup]
+    d = np.diff(ts)
+    is_gap = d > tauInSec
+    gaps = pd.DataFrame({"start": ts[:-1][is_gap] + tauInSec,
+                         "length": d[is_gap] // tauInSec - 1})
+    month = ts.astype("datetime64[s]").astype("datetime64[M]")
+    bucket = (month - month[0]).astype(np.int64)
+    present = np.bincount(bucket)
+    has_data = present > 0
+    first = ts[np.searchsorted(bucket, np.arange(present.shape[0]))[has_data]]
+    last = ts[np.searchsorted(bucket, np.arange(present.shape[0]), "right")[has_data] - 1]
+    expected = (last - first) // tauInSec + 1
+    months = pd.DataFrame({"month": (month[0] + np.flatnonzero(has_data)).astype(str),
+                           "first": first, "last": last, "expected": expected,
+                           "present": present[has_data],
+                           "missing_ratio": 1 - present[has_data]/expected})
+    expected_total = (ts[-1] - ts[0]) // tauInSec + 1
+    return GapReport(1 - ts.shape[0]/expected_total, months, gaps,
+                     pd.DataFrame({"timestamp": dup_ts, "count": dup_cnt + 1}))
+
+def fill_gaps(DF, tauInMin=60):
+    # reindex DF on the full timestamp grid; missing candles repeat the
+    # previous close as open, high, low and close with zero volume and
+    # zero derived returns (logRet, maxRet, minRet), columns keep their dtype
+    tauInSec = 60*tauInMin
+    DF = DF.drop_duplicates("timestamp", keep="last").set_index("timestamp").sort_index()
+    dtypes = DF.dtypes
+    grid = np.arange(DF.index[0], DF.index[-1]+1, tauInSec)
+    missing = ~np.isin(grid, DF.index)
+    DF = DF.reindex(grid)
+    prev_close = DF["close"].ffill()
+    for c in ["open", "high", "low", "close"]:
+        DF.loc[missing, c] = prev_close[missing]
+    for c in ["volume", "trades", "logRet", "maxRet", "minRet"]:
+        if c in DF:
+            DF.loc[missing, c] = 0
+    # reindex turned integer columns with missing rows into float
+    filled = [c for c in DF if c in dtypes and not DF[c].isna().any()]
+    DF = DF.astype({c: dtypes[c] for c in filled})
+    return DF.rename_axis("timestamp").reset_index()
+
+def analyze_gaps(DF, tauInMin=60):
+    R = gap_report(DF["timestamp"].to_numpy(), tauInMin)
+    print("#duplicates=", int(np.sum(R.duplicates["count"] - 1)))
+    print("Missing ", R.missing_ratio)
+    plt.bar(R.months["month"], R.months["missing_ratio"])
     plt.xticks(rotation=45)
     plt.ylim(0,1)
     plt.ylabel("#Missing Observations / #Expected Observations")
     plt.show()
+    return R
 
 def timeseries_plot(DF, plot_cumulative=False):
     DF["Y-MM"] = DF['timestamp'].apply(lambda x: datetime.datetime.utcfromtimestamp(x).strftime('%Y-%m'))
@@ -85,6 +134,10 @@ def timeseries_plot(DF, plot_cumulative=False):
     plt.show()
 
 def analyze_returns(DF, degree_of_f=4):
+    from statsmodels.tsa.stattools import adfuller
+    from statsmodels.graphics.tsaplots import plot_acf
+    from statsmodels.formula.api import ols
+    from statsmodels.stats.stattools import durbin_watson
     DF["logRet"] = DF["close"].apply(lambda x: np.log(x)) - DF["open"].apply(lambda x: np.log(x))
     M = DF[["timestamp", "logRet"]].to_numpy()
     X = M[:,1]
@@ -139,26 +192,16 @@ def analyze_returns(DF, degree_of_f=4):
     plt.ylabel('r[t]')
     plt.show()
 
-def poll_data():
+def poll_data(workers=4, rate=2.0):
     MAX_POLL = 400
     date_from = datetime.datetime.strptime('2020-03-01T16:41:24+0200', "%Y-%m-%dT%H:%M:%S%z")
     date_to = datetime.datetime.strptime('2022-01-14T16:41:24+0200', "%Y-%m-%dT%H:%M:%S%z")
 
-    H = pd.DataFrame()
-
-    delta_sec = MAX_POLL * 60
-    t1 = date_from
-    idx = 0
-    while (t1 < date_to):
-        t0 = t1 + datetime.timedelta(0, 3600);
-        t1 = t0 + datetime.timedelta(0, delta_sec);
-        sQuery = construct_query(t0, t1)
-        print("query ", idx, "t0=", t0, "t1=", t1)
-        response = requests.get(sQuery)
-        H = update_data(response, H)
-        idx = idx + 1
-
-    H.sort_values(by = "timestamp", inplace=True)  
+    # pages of MAX_POLL hourly candles, fetched concurrently
+    source = fetcher.bitpanda_source()
+    source.page_size = MAX_POLL
+    t0 = int(date_from.timestamp()) + 3600
+    H = fetcher.fetch(source, t0, int(date_to.timestamp()), workers=workers, rate=rate)
     print("data collected")
     H.to_pickle("./data_raw.pkl")
     print("data stored")
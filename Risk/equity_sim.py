@@ -0,0 +1,193 @@
+# Batch simulator of the Equity (FPS) reserve
+#
+# Replays a sequence of steps on many scenarios at once. In every step
+# a loss shock hits the reserve (Frankencoin.coverLoss, negative values
+# are profits), then investors invest ZCHF (Equity.invest) and redeem
+# FPS (Equity.calculateProceeds). State and flows are Python integers
+# with 18 decimals in numpy object arrays and share issuance uses the
+# exact model of MathUtil._cubicRoot from cubic_root.py, so every
+# scenario follows the contract to the last wei. Calls that revert in
+# the contract are flagged and leave the state unchanged. The holding
+# period required by canRedeem is not modelled.
+
+from dataclasses import dataclass
+import numpy as np
+from . import cubic_root
+from .cubic_root import ONE_DEC18, mulD18_exact, divD18_exact, power3_exact
+
+VALUATION_FACTOR = 3
+MINIMUM_EQUITY = 1000 * ONE_DEC18
+UINT96_MAX = 2**96 - 1
+
+
+def to_dec18(x):
+    # ZCHF amounts as object array of integers with 18 decimals
+    return np.array([int(round(float(v) * 1e18)) for v in np.ravel(x)],
+                    dtype=object).reshape(np.shape(x))
+
+def from_dec18(x):
+    return np.array([int(v) / 1e18 for v in np.ravel(x)]).reshape(np.shape(x))
+
+def equity_price(equity, total_shares):
+    # Equity.price
+    safe = np.where(total_shares == 0, 1, total_shares)
+    p = (VALUATION_FACTOR * equity * ONE_DEC18) // safe
+    return np.where((equity == 0) | (total_shares == 0), ONE_DEC18, p)
+
+def calculate_shares(capital_before, total_shares, investment):
+    """
+    Equity._calculateShares for arrays of scenarios
+    capital_before : equity before the investment
+    total_shares : FPS supply
+    investment : ZCHF invested
+    return [shares, reverted]
+    """
+    ex_fees = (investment * 997) // 1000
+    initial = ((capital_before < MINIMUM_EQUITY) | (total_shares == 0)).astype(bool)
+    new_total = total_shares + 1000 * ONE_DEC18
+    reverted = np.zeros(initial.shape, dtype=bool)
+    idx = np.flatnonzero(~initial)
+    if idx.shape[0] > 0:
+        cap = capital_before[idx]
+        [root, _, fail] = cubic_root.cubic_root_exact(divD18_exact(cap + ex_fees[idx], cap))
+        new_total[idx] = mulD18_exact(total_shares[idx], root)
+        reverted[idx] = fail
+    return [np.where(reverted, 0, new_total - total_shares), reverted]
+
+def calculate_proceeds(capital, total_shares, shares):
+    """
+    Equity.calculateProceeds for arrays of scenarios
+    return [proceeds, reverted], reverted if less than one share would remain
+    """
+    reverted = (shares + ONE_DEC18 >= total_shares).astype(bool)
+    safe = np.where(reverted, 1, total_shares)
+    reduction = (shares * 997) // 1000
+    new_capital = mulD18_exact(capital, power3_exact(divD18_exact(np.where(reverted, 0, safe - reduction), safe)))
+    return [np.where(reverted, 0, capital - new_capital), reverted]
+
+@dataclass
+class EquityPaths:
+    """
+    State after every step, arrays of shape (num_steps, num_scenarios),
+    amounts with 18 decimals
+    equity : Frankencoin.equity, reserve balance minus minter reserve
+    total_shares : FPS supply
+    price : FPS price
+    minted : FPS issued to investors
+    dilution : minted / total_shares before the step
+    proceeds : ZCHF paid to redeeming FPS holders
+    redemption_capacity : ZCHF paid when redeeming all but one FPS
+    uncovered_loss : part of the loss shock beyond the reserve balance
+    invest_reverted, redeem_reverted : the contract call reverted
+    """
+    equity: np.ndarray
+    total_shares: np.ndarray
+    price: np.ndarray
+    minted: np.ndarray
+    dilution: np.ndarray
+    proceeds: np.ndarray
+    redemption_capacity: np.ndarray
+    uncovered_loss: np.ndarray
+    invest_reverted: np.ndarray
+    redeem_reverted: np.ndarray
+
+def simulate_equity(invest, redeem, loss, equity0, shares0, minter_reserve=0):
+    """
+    Replay investor flows and loss shocks on many scenarios
+    invest : (num_steps, num_scenarios) ZCHF invested per step, 18 decimals
+    redeem : (num_steps, num_scenarios) FPS redeemed per step, 18 decimals
+    loss : (num_steps, num_scenarios) losses covered by the reserve,
+           negative for profits, 18 decimals
+    equity0, shares0 : initial equity and FPS supply, scalar or per scenario
+    minter_reserve : minter reserve held by the Equity contract
+    return EquityPaths
+    """
+    [invest, redeem, loss] = [np.asarray(a, dtype=object) for a in [invest, redeem, loss]]
+    (num_steps, n) = invest.shape
+    minter_reserve = int(minter_reserve)
+    balance = np.full(n, 0, dtype=object) + equity0 + minter_reserve
+    shares = np.full(n, 0, dtype=object) + shares0
+    out = {k: np.zeros((num_steps, n), dtype=object) for k in
+           ["equity", "total_shares", "price", "minted", "proceeds", "redemption_capacity", "uncovered_loss"]}
+    dilution = np.zeros((num_steps, n))
+    inv_rev = np.zeros((num_steps, n), dtype=bool)
+    red_rev = np.zeros((num_steps, n), dtype=bool)
+
+    def equity():
+        return np.maximum(balance - minter_reserve, 0)
+
+    for t in range(num_steps):
+        # loss shock, Frankencoin.coverLoss mints what the reserve lacks
+        balance = balance - loss[t]
+        out["uncovered_loss"][t] = np.maximum(-balance, 0)
+        balance = np.maximum(balance, 0)
+        # invest
+        amount = invest[t]
+        active = (amount > 0).astype(bool)
+        eq_after = np.maximum(balance + amount - minter_reserve, 0)
+        cap_before = np.where(eq_after <= amount, 0, eq_after - amount)
+        [minted, rev] = calculate_shares(cap_before, shares, amount)
+        rev = rev | (eq_after < MINIMUM_EQUITY).astype(bool) | ((shares + minted) > UINT96_MAX).astype(bool)
+        ok = active & ~rev
+        dilution[t] = np.where(ok, from_dec18(minted) / np.maximum(from_dec18(shares), 1e-18), 0.0)
+        balance = np.where(ok, balance + amount, balance)
+        shares = np.where(ok, shares + minted, shares)
+        out["minted"][t] = np.where(ok, minted, 0)
+        inv_rev[t] = active & rev
+        # redeem
+        amount = redeem[t]
+        active = (amount > 0).astype(bool)
+        [proceeds, rev] = calculate_proceeds(equity(), shares, amount)
+        ok = active & ~rev
+        balance = np.where(ok, balance - proceeds, balance)
+        shares = np.where(ok, shares - amount, shares)
+        out["proceeds"][t] = np.where(ok, proceeds, 0)
+        red_rev[t] = active & rev
+        # state
+        eq = equity()
+        out["equity"][t] = eq
+        out["total_shares"][t] = shares
+        out["price"][t] = equity_price(eq, shares)
+        out["redemption_capacity"][t] = calculate_proceeds(eq, shares, np.maximum(shares - ONE_DEC18 - 1, 0))[0]
+    return EquityPaths(out["equity"], out["total_shares"], out["price"], out["minted"], dilution,
+                       out["proceeds"], out["redemption_capacity"], out["uncovered_loss"], inv_rev, red_rev)
+
+def losses_from_distribution(L, exposure, num_steps, num_scenarios, seed=None):
+    """
+    Loss shocks drawn from a loss distribution, e.g. expected_shortfall.loss_dist
+    L : loss samples per unit of collateral, negative values are gains
+    exposure : ZCHF collateral value liquidated per step
+    return (num_steps, num_scenarios) loss shocks with 18 decimals
+    """
+    rng = np.random.default_rng(seed)
+    draws = rng.choice(np.asarray(L), size=(num_steps, num_scenarios)) * exposure
+    return to_dec18(draws)
+
+if __name__ == "__main__":
+    import time
+    from . import candle_store
+    from . import expected_shortfall
+    # daily liquidations with the loss distribution of expected_shortfall.py
+    TauIn = 1440
+    candles = candle_store.load_candles(TauIn, ["logRet", "maxRet"])
+    tau = 72
+    r = expected_shortfall.construct_overlapping_returns(np.asarray(candles["logRet"]), TauIn, tau*60)
+    r_max = expected_shortfall.construct_overlapping_returns(np.asarray(candles["maxRet"]), TauIn, tau*60)
+    expected_shortfall.h = 0.10
+    expected_shortfall.rateK = 0.02
+    L = expected_shortfall.loss_dist(r, r_max, 0.0)
+    num_steps, num_scenarios = 365, 2_000
+    rng = np.random.default_rng(1)
+    loss = losses_from_distribution(L, 50_000, num_steps, num_scenarios, seed=2)
+    invest = to_dec18(rng.exponential(5_000, (num_steps, num_scenarios)) * (rng.random((num_steps, num_scenarios)) < 0.3))
+    redeem = to_dec18(rng.exponential(2, (num_steps, num_scenarios)) * (rng.random((num_steps, num_scenarios)) < 0.1))
+    t0 = time.perf_counter()
+    P = simulate_equity(invest, redeem, loss, equity0=1_000_000 * ONE_DEC18, shares0=3_000 * ONE_DEC18)
+    print(f"{num_steps} steps x {num_scenarios} scenarios in {time.perf_counter()-t0:.1f}s")
+    price = from_dec18(P.price[-1])
+    cap = from_dec18(P.redemption_capacity[-1])
+    print(f"final FPS price: median {np.median(price):.2f}, 1%-quantile {np.quantile(price, 0.01):.2f}")
+    print(f"redemption capacity: median {np.median(cap):.0f} ZCHF")
+    print(f"mean dilution per step {np.mean(P.dilution):.2e}, "
+          f"reverted invests {np.sum(P.invest_reverted)}, redeems {np.sum(P.redeem_reverted)}, "
+          f"scenarios with uncovered losses {np.sum(np.any(P.uncovered_loss > 0, 0))}")
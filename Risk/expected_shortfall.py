@@ -1,10 +1,13 @@
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-from scipy import stats
-from scipy.stats import genpareto
-import statsmodels.api as sm
-import statsmodels.graphics.gofplots as gofplots
+from . import rolling
+from . import candle_store
+from . import instrument
+from . import result_cache
+from ._lazy import lazy
+
+plt = lazy("matplotlib.pyplot")
+stats = lazy("scipy.stats")
 
 def loss_dist(r, r_max, hDash):
     thresh = np.log(1+h) - np.log(1+hDash)
@@ -28,13 +31,35 @@ def empirical_mean_excess_function(L, u):
     emp_ex = np.sum(np.maximum(L-u, 0)) / np.sum(L>u)
     return emp_ex
 
+def mean_excess_function(L, u=None):
+    """
+    Calculate empirical mean excess function for many thresholds at once
+    L : vector of losses
+    u : vector of thresholds, defaults to the sorted losses
+    return empirical excess mean e(u) for each threshold,
+           same as empirical_mean_excess_function(L, u[t]) for every t
+           and nan where no loss exceeds the threshold.
+    L is sorted once; the sum over the losses above each threshold is
+    read from suffix sums, O(n log n) for the whole curve.
+    """
+    L_sorted = np.sort(L)
+    if u is None:
+        u = L_sorted
+    n = L_sorted.shape[0]
+    # suffix_sum[i] = sum(L_sorted[i:])
+    suffix_sum = np.zeros(n+1)
+    suffix_sum[:n] = np.cumsum(L_sorted[::-1])[::-1]
+    idx = np.searchsorted(L_sorted, u, 'right')
+    num_exceed = n - idx
+    with np.errstate(divide='ignore', invalid='ignore'):
+        emp_ex = suffix_sum[idx] / num_exceed - u
+    return np.where(num_exceed > 0, emp_ex, np.nan)
+
+@instrument.timed("plot mean excess")
 def plot_eme(L, u_start):
     u_end = np.quantile(L, 1-0.5/100)
     Lsub = L[(L>=u_start) & (L<=u_end)]
-    num_u = Lsub.shape[0]
-    emx = np.zeros(num_u)
-    for t in range(num_u):
-        emx[t] = empirical_mean_excess_function(L, Lsub[t])
+    emx = mean_excess_function(L, Lsub)
     plt.figure
     plt.plot(Lsub, emx, '+')
     plt.xlabel("Loss, h'="+str(hDash))
@@ -42,7 +67,10 @@ def plot_eme(L, u_start):
     plt.grid()
     plt.show()
     
+@instrument.timed("GPD fit and plots")
 def estimate_tail_loss(u_thresh):
+    from scipy.stats import genpareto
+    import statsmodels.graphics.gofplots as gofplots
     # tail loss
     X = get_tail_loss(r, r_max, hDash, u_thresh)
     print(f"Number of observations for u={u_thresh:.2f}: {X.shape[0]:.0f}")
@@ -74,6 +102,7 @@ def estimate_tail_loss(u_thresh):
     print("ES empirical = {:.4f} ES pareto = {:.4f}".format(ES_emp, ES1))
     print("Max loss = ", np.max(X))
 
+@instrument.timed("plot loss given h'")
 def plot_max_loss_given_h(r, r_max):
     hDashVec = np.arange(0.99, 1.1, 0.01)-1
     lmaxminmed= np.zeros((hDashVec.shape[0],3))
@@ -93,35 +122,45 @@ def plot_max_loss_given_h(r, r_max):
     
 
 def construct_overlapping_returns(r_in, TauIn_min, tau_min):
+    # sum over num_roll consecutive returns, wrapping around the end
+    # of r_in; the last two windows are dropped
     num_roll = int(np.round(tau_min/TauIn_min))
-    R = np.zeros((r_in.shape[0], num_roll))
-    for k in range(num_roll):
-        R[:,k]=np.roll(r_in, -k)
-    R = R[0:R.shape[0]-2,:]
-    return np.sum(R, 1)
-
-# 1) data
-TauIn = 1440#60
-DF = pd.read_pickle("./Risk/XBTCHF_"+str(TauIn)+"_Processed_v3.pkl")
-r_in = DF["logRet"].to_numpy()
-stats.describe(r_in)
-r_in_max = DF["maxRet"].to_numpy()
-# 2) parameters
-h = 0.10 # required maintenance margin and ultimately the haircut
-rateK = 0.02 # challenger fee
-tau_min = 1 * 24 * 60# 1 * 24 hours of duration for liquidation
-r = construct_overlapping_returns(r_in, TauIn, tau_min)
-r_max = construct_overlapping_returns(r_in_max, TauIn, tau_min)
-
-plot_max_loss_given_h(r, r_max)
-
-# plain loss distribution
-hDash = 0.05
-L = loss_dist(r, r_max, hDash)
-print(stats.describe(L))
-
-# EME
-plot_eme(L, u_start=0)
-
-# GPD
-estimate_tail_loss(u_thresh=0.05)
+    R = rolling.rolling_sum(r_in, num_roll, wrap=True)
+    return R[0:R.shape[0]-2]
+
+if __name__ == "__main__":
+    # 1) data
+    TauIn = 1440#60
+    candles = candle_store.load_candles(TauIn, ["logRet", "maxRet"])
+    r_in = np.asarray(candles["logRet"])
+    stats.describe(r_in)
+    r_in_max = np.asarray(candles["maxRet"])
+    # 2) parameters
+    h = 0.10 # required maintenance margin and ultimately the haircut
+    rateK = 0.02 # challenger fee
+    tau_min = 1 * 24 * 60# 1 * 24 hours of duration for liquidation
+    def compute_overlapping():
+        return {"r": construct_overlapping_returns(r_in, TauIn, tau_min),
+                "r_max": construct_overlapping_returns(r_in_max, TauIn, tau_min)}
+
+    if result_cache.enabled():
+        overlapping = result_cache.ResultCache().cached(
+            [r_in, r_in_max], {"TauIn": TauIn, "tau_min": tau_min, "method": "overlapping"},
+            compute_overlapping)
+    else:
+        overlapping = compute_overlapping()
+    r = np.asarray(overlapping["r"])
+    r_max = np.asarray(overlapping["r_max"])
+
+    plot_max_loss_given_h(r, r_max)
+
+    # plain loss distribution
+    hDash = 0.05
+    L = loss_dist(r, r_max, hDash)
+    print(stats.describe(L))
+
+    # EME
+    plot_eme(L, u_start=0)
+
+    # GPD
+    estimate_tail_loss(u_thresh=0.05)
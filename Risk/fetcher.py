@@ -0,0 +1,254 @@
+# Concurrent candle fetcher
+#
+# The requested time range is split into pages up front. Pages are
+# fetched on a thread pool through a transport, a callable
+# transport(url, params) -> decoded JSON, with a shared rate limit and
+# retries. The pages are collected in a list and concatenated once.
+#
+# Kraken's OHLC endpoint only serves the latest 720 candles, whatever
+# the since parameter. Sources with such a limit set max_history. A
+# response that holds the full max_history candles and still starts
+# after its window was cut off by the limit and raises, instead of
+# returning a history with holes; a window starting in a gap of the
+# exchange data gives a shorter response and is accepted.
+#
+# RequestsTransport keeps a pooled requests.Session. FixtureServer
+# replays the candle CSV files of this folder in the Kraken OHLC format
+# on localhost, with the same history limit, so the fetcher can be run
+# offline.
+
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable
+from urllib.parse import parse_qs, urlparse
+import numpy as np
+import pandas as pd
+
+KRAKEN_URL = "https://api.kraken.com"
+BITPANDA_URL = "https://api.exchange.bitpanda.com"
+CANDLE_COLUMNS = ["timestamp", "open", "high", "low", "close", "volume", "trades"]
+# candles served by the Kraken OHLC endpoint, counted back from the latest
+KRAKEN_HISTORY = 720
+
+
+@dataclass
+class Source:
+    """
+    Candle endpoint
+    url : endpoint url
+    interval : candle time in minutes
+    page_size : candles per request
+    params : (t0, t1) -> query parameters for the page [t0, t1)
+    parse : decoded JSON -> DataFrame with a timestamp column
+    max_history : number of latest candles the endpoint serves, None if
+                  any window can be requested
+    """
+    url: str
+    interval: int
+    page_size: int
+    params: Callable
+    parse: Callable
+    max_history: int = None
+
+def kraken_source(pair="XBTCHF", interval=1440, base_url=KRAKEN_URL, page_size=720):
+    # https://docs.kraken.com/rest/#operation/getOHLCData, up to 720 candles per call,
+    # older candles are only available from the downloadable files (kraken_data.py)
+    def params(t0, t1):
+        return {"pair": pair, "interval": interval, "since": t0}
+
+    def parse(a_json):
+        if a_json.get("error"):
+            raise IOError("kraken: " + ", ".join(a_json["error"]))
+        key = [k for k in a_json["result"] if k != "last"][0]
+        df = pd.DataFrame(a_json["result"][key],
+                          columns=["timestamp", "open", "high", "low", "close", "vwap", "volume", "trades"])
+        df = df.drop(["vwap"], axis=1)
+        return df.astype({"timestamp": "int64", "open": float, "high": float, "low": float,
+                          "close": float, "volume": float, "trades": "int64"})
+
+    return Source(base_url + "/0/public/OHLC", interval, page_size, params, parse,
+                  max_history=KRAKEN_HISTORY)
+
+def bitpanda_source(instrument="BTC_CHF", base_url=BITPANDA_URL):
+    # hourly candles, see data_roller.construct_query
+    def params(t0, t1):
+        fmt = '%Y-%m-%dT%H:%M:%S.%fZ'
+        return {"unit": "HOURS", "period": 1,
+                "from": pd.Timestamp(t0, unit="s").strftime(fmt),
+                "to": pd.Timestamp(t1, unit="s").strftime(fmt)}
+
+    def parse(a_json):
+        # keeps the bitpanda columns (time, total_amount, ...)
+        df = pd.DataFrame.from_dict(a_json)
+        if len(df) == 0:
+            return pd.DataFrame(columns=["timestamp"])
+        epoch = pd.Timestamp("1970-01-01", tz="UTC")
+        df["timestamp"] = (pd.to_datetime(df["time"], utc=True) - epoch) // pd.Timedelta(seconds=1)
+        for s in ["close", "open", "low", "high", "total_amount", "volume"]:
+            df[s] = pd.to_numeric(df[s])
+        return df
+
+    return Source(base_url + "/public/v1/candlesticks/" + instrument, 60, 400, params, parse)
+
+def plan_windows(t_start, t_end, interval, page_size):
+    # [t0, t1) windows of page_size candles covering [t_start, t_end)
+    step = interval * 60 * page_size
+    t0 = np.arange(t_start, t_end, step)
+    return list(zip(t0.tolist(), np.minimum(t0 + step, t_end).tolist()))
+
+
+class RateLimiter:
+    # at most rate calls per second over all threads
+    def __init__(self, rate):
+        self.interval = 1.0/rate if rate else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            t = max(now, self._next)
+            self._next = t + self.interval
+        if t > now:
+            time.sleep(t - now)
+
+class RequestsTransport:
+    # GET with a pooled keep-alive session shared by all threads
+    def __init__(self, pool_size=8, timeout=30):
+        import requests
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.timeout = timeout
+
+    def __call__(self, url, params):
+        response = self.session.get(url, params=params, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+def _fetch_page(source, transport, limiter, retries, backoff, window):
+    [t0, t1] = window
+    for attempt in range(retries+1):
+        limiter.wait()
+        try:
+            df = source.parse(transport(source.url, source.params(t0, t1)))
+            break
+        except Exception as e:
+            if attempt == retries:
+                raise
+            print(f"retry {attempt+1} for [{t0}, {t1}): {e}")
+            time.sleep(backoff * 2**attempt)
+    # all candles from t0 on fit into a response of fewer than max_history
+    # candles, a full response starting after t0 is the latest max_history
+    if source.max_history is not None and len(df) >= source.max_history:
+        first = int(df["timestamp"].min())
+        if first > t0 + 60*source.interval:
+            raise IOError(f"page [{t0}, {t1}) starts at {first}: the endpoint only serves "
+                          f"the latest {source.max_history} candles")
+    return df[(df["timestamp"] >= t0) & (df["timestamp"] < t1)]
+
+def fetch(source, t_start, t_end, transport=None, workers=4, rate=1.0, retries=3, backoff=0.5):
+    """
+    Fetch all candles in [t_start, t_end)
+    source : Source, e.g. kraken_source()
+    t_start, t_end : unix timestamps in seconds
+    transport : callable (url, params) -> decoded JSON, default RequestsTransport
+    workers : concurrent requests
+    rate : maximal requests per second, None for no limit
+    retries : retries per page, waiting backoff * 2^attempt seconds
+    return DataFrame sorted by timestamp without duplicates
+    """
+    if transport is None:
+        transport = RequestsTransport(pool_size=workers)
+    windows = plan_windows(t_start, t_end, source.interval, source.page_size)
+    limiter = RateLimiter(rate)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pages = list(pool.map(lambda w: _fetch_page(source, transport, limiter, retries, backoff, w),
+                              windows))
+    if len(pages) == 0:
+        return pd.DataFrame(columns=CANDLE_COLUMNS)
+    DF = pd.concat(pages, ignore_index=True)
+    DF = DF.drop_duplicates("timestamp", keep="last").sort_values("timestamp")
+    return DF.reset_index(drop=True)
+
+
+class FixtureServer:
+    """
+    Local stand-in for the Kraken OHLC endpoint replaying candle CSV files
+    files : {(pair, interval): path to csv with CANDLE_COLUMNS, no header}
+    page_size : candles per response
+    history : only the latest history candles of a file are served, as by
+              Kraken, None to serve the whole file
+    usage:
+        with FixtureServer({("XBTCHF", 1440): "./Risk/XBTCHF_1440.csv"}) as srv:
+            DF = fetch(kraken_source("XBTCHF", 1440, srv.url), t0, t1)
+    """
+    def __init__(self, files, page_size=720, history=KRAKEN_HISTORY, port=0):
+        self.data = {key: np.loadtxt(path, delimiter=",", ndmin=2) for key, path in files.items()}
+        self.page_size = page_size
+        self.history = history
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                q = {k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
+                body = server.ohlc(q.get("pair"), int(q.get("interval", 1)), int(q.get("since", 0)))
+                raw = json.dumps(body).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(raw)))
+                self.end_headers()
+                self.wfile.write(raw)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def ohlc(self, pair, interval, since):
+        # Kraken response: [time, open, high, low, close, vwap, volume, count]
+        if (pair, interval) not in self.data:
+            return {"error": [f"EQuery:Unknown asset pair {pair}/{interval}"]}
+        M = self.data[(pair, interval)]
+        if self.history is not None:
+            M = M[-self.history:]
+        M = M[M[:, 0] >= since][:self.page_size]
+        rows = [[int(x[0]), str(x[1]), str(x[2]), str(x[3]), str(x[4]), str(x[4]), str(x[5]), int(x[6])]
+                for x in M]
+        last = int(M[-1, 0]) if M.shape[0] > 0 else since
+        return {"error": [], "result": {pair: rows, "last": last}}
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+if __name__ == "__main__":
+    # replay the bundled daily candles and compare with the file
+    path = "./Risk/XBTCHF_1440.csv"
+    M = np.loadtxt(path, delimiter=",")
+    M_served = M[-KRAKEN_HISTORY:]
+    with FixtureServer({("XBTCHF", 1440): path}) as srv:
+        source = kraken_source("XBTCHF", 1440, srv.url, 100)
+        t0 = time.perf_counter()
+        DF = fetch(source, int(M_served[0, 0]), int(M[-1, 0])+1, workers=8, rate=None)
+        dt = time.perf_counter() - t0
+        print(f"{DF.shape[0]} candles in {dt:.2f}s, equal to file: "
+              f"{np.allclose(DF[CANDLE_COLUMNS].to_numpy(dtype=float), M_served)}")
+        try:
+            fetch(source, int(M[0, 0]), int(M[-1, 0])+1, workers=8, rate=None, retries=0)
+        except IOError as e:
+            print("full history:", e)
@@ -0,0 +1,208 @@
+# Peaks-over-threshold fit of the loss tail with a generalized Pareto
+# distribution (GPD)
+#
+# The excesses Y = L - u over a threshold u are fitted with shape xi
+# and scale beta (scipy's genpareto c = xi, loc = 0). The likelihood
+# is maximized over the single parameter theta = xi/beta of the profile
+# log-likelihood (Grimshaw 1993), for many samples at once: rows of a
+# (B, n) array are fitted in parallel, so bootstrap refits and
+# threshold sweeps do not restart a generic optimizer per fit. The
+# search runs in z = log(1 + theta*max(y)), which maps the support
+# theta > -1/max(y) to the real line and passes through theta = 0 (the
+# exponential tail). A grid scan brackets the maximum, golden-section
+# steps narrow the bracket to GOLDEN_TOL. Shapes xi < -1, where the
+# likelihood is unbounded at the largest excess, are excluded.
+#
+# VaR and ES of the loss follow from the tail estimator
+#   VaR_q = u + beta/xi * (((1-q) N/N_u)^(-xi) - 1)
+#   ES_q = (VaR_q + beta - xi*u) / (1 - xi)
+# with N losses of which N_u exceed u.
+
+from dataclasses import dataclass
+import numpy as np
+from . import expected_shortfall
+from . import instrument
+
+GRID_POINTS = 64
+GRID_Z = 13.8 # search theta*max(y) in [exp(-GRID_Z) - 1, exp(GRID_Z) - 1]
+GOLDEN_TOL = 1e-9
+INV_PHI = (np.sqrt(5) - 1) / 2
+
+
+def pwm_fit(Y):
+    """
+    Probability-weighted moments estimate, Hosking & Wallis (1987)
+    Y : (n,) or (B, n) excesses, one sample per row
+    return [xi, beta] per row; constant rows, for which the estimate
+           is undefined, get xi = -1 and beta = their value
+    """
+    Y = np.sort(np.atleast_2d(Y), 1)
+    n = Y.shape[1]
+    a0 = np.mean(Y, 1)
+    a1 = np.mean(Y * ((n - np.arange(1, n+1)) / max(n-1, 1)), 1)
+    d = a0 - 2*a1
+    ok = d > 0
+    d = np.where(ok, d, 1.0)
+    return [np.where(ok, 2 - a0/d, -1.0), np.where(ok, 2*a0*a1/d, a0)]
+
+def _profile_fit(Y, y_max, z):
+    """
+    Profile log-likelihood per observation at z = log(1 + theta*y_max)
+    return [ll, xi, beta] per row, ll = -1 - log(beta) - xi with
+           xi = mean log(1 + theta y) and beta = xi/theta (mean y at theta = 0)
+    """
+    theta = np.expm1(z) / y_max
+    x = theta[:, None] * Y
+    # log1p(x)/x -> 1 for x -> 0
+    f = np.log1p(x) / np.where(x == 0, 1.0, x)
+    beta = np.mean(Y * np.where(x == 0, 1.0, f), 1)
+    xi = theta * beta
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ll = -1 - np.log(beta) - xi
+    return [np.where(np.isfinite(ll) & (xi >= -1), ll, -np.inf), xi, beta]
+
+def mle_fit(Y, tol=GOLDEN_TOL):
+    """
+    Maximum likelihood fit, vectorized over rows
+    Y : (n,) or (B, n) excesses
+    tol : width of the final bracket in z
+    return [xi, beta] per row
+    """
+    Y = np.atleast_2d(np.asarray(Y, dtype=float))
+    rows = np.arange(Y.shape[0])
+    y_max = np.max(Y, 1)
+    grid = np.linspace(-GRID_Z, GRID_Z, GRID_POINTS)
+    ll = np.stack([_profile_fit(Y, y_max, np.full(Y.shape[0], z))[0] for z in grid], 1)
+    k = np.argmax(ll, 1)
+    a = grid[np.maximum(k-1, 0)]
+    b = grid[np.minimum(k+1, GRID_POINTS-1)]
+    c = b - INV_PHI*(b - a)
+    d = a + INV_PHI*(b - a)
+    f_c = _profile_fit(Y, y_max, c)[0]
+    f_d = _profile_fit(Y, y_max, d)[0]
+    while np.max(b - a) > tol:
+        left = f_c >= f_d
+        # maximum in [a, d] if f(c) >= f(d), else in [c, b]
+        [a, b] = [np.where(left, a, c), np.where(left, d, b)]
+        new = np.where(left, b - INV_PHI*(b - a), a + INV_PHI*(b - a))
+        f_new = _profile_fit(Y, y_max, new)[0]
+        [c, d, f_c, f_d] = [np.where(left, new, d), np.where(left, c, new),
+                            np.where(left, f_new, f_d), np.where(left, f_c, f_new)]
+    # the bracket's interior point or the best grid point, whichever is higher
+    z = np.where(f_c >= f_d, c, d)
+    f_z = np.maximum(f_c, f_d)
+    z = np.where(f_z >= ll[rows, k], z, grid[k])
+    [_, xi, beta] = _profile_fit(Y, y_max, z)
+    return [xi, beta]
+
+
+@dataclass
+class GPDFit:
+    """
+    u : threshold
+    xi, beta : shape and scale, scalars or arrays (e.g. bootstrap replicates)
+    num_exceed : losses above u
+    num_total : number of losses
+    """
+    u: float
+    xi: np.ndarray
+    beta: np.ndarray
+    num_exceed: int
+    num_total: int
+
+    def var(self, q):
+        q = np.asarray(q, dtype=float)[..., None]
+        tail = (1-q) * self.num_total / self.num_exceed
+        return self.u + self.beta/self.xi * (tail**(-self.xi) - 1)
+
+    def es(self, q):
+        # infinite for xi >= 1
+        with np.errstate(divide="ignore"):
+            es = (self.var(q) + self.beta - self.xi*self.u) / (1 - self.xi)
+        return np.where(self.xi < 1, es, np.inf)
+
+def fit_tail(L, u):
+    # GPD fit of the losses L above the threshold u
+    L = np.asarray(L)
+    Y = L[L > u] - u
+    [xi, beta] = mle_fit(Y)
+    return GPDFit(u, xi[0], beta[0], Y.shape[0], L.shape[0])
+
+def bootstrap_es(L, u, levels=(0.95, 0.99), B=1_000, ci=0.95, seed=None, chunk=250):
+    """
+    ES at several levels with bootstrap confidence intervals
+    L : losses
+    u : threshold
+    B : bootstrap replicates of the excesses, refitted chunk rows at a time
+    ci : coverage of the percentile intervals
+    return dict with "fit" (GPDFit), "es", "lower", "upper" per level and
+           "replicates" (B, levels)
+    """
+    fit = fit_tail(L, u)
+    L = np.asarray(L)
+    Y = L[L > u] - u
+    rng = np.random.default_rng(seed)
+    xi = np.zeros(B)
+    beta = np.zeros(B)
+    with instrument.stage("GPD bootstrap", replications=B):
+        for j in range(0, B, chunk):
+            rows = min(chunk, B - j)
+            Yb = Y[rng.integers(0, Y.shape[0], (rows, Y.shape[0]))]
+            [xi[j:j+rows], beta[j:j+rows]] = mle_fit(Yb)
+    reps = GPDFit(u, xi, beta, fit.num_exceed, fit.num_total).es(levels).T
+    alpha = (1 - ci) / 2
+    return {"fit": fit,
+            "es": np.ravel(fit.es(levels)),
+            "lower": np.quantile(reps, alpha, axis=0),
+            "upper": np.quantile(reps, 1-alpha, axis=0),
+            "replicates": reps}
+
+def threshold_sweep(L, thresholds, levels=(0.95, 0.99), min_exceed=30):
+    """
+    Fit the tail for candidate thresholds, e.g. where the mean excess
+    function (expected_shortfall.mean_excess_function) becomes linear
+    thresholds : increasing candidate thresholds
+    return list of dicts with u, num_exceed, mean_excess, xi, beta and ES per level
+    """
+    L = np.asarray(L)
+    e = expected_shortfall.mean_excess_function(L, np.asarray(thresholds))
+    res = []
+    for u, e_u in zip(thresholds, e):
+        n_u = int(np.sum(L > u))
+        if n_u < min_exceed:
+            break
+        fit = fit_tail(L, u)
+        res.append({"u": u, "num_exceed": n_u, "mean_excess": e_u, "xi": fit.xi, "beta": fit.beta,
+                    "es": np.ravel(fit.es(levels))})
+    return res
+
+if __name__ == "__main__":
+    import time
+    from scipy.stats import genpareto
+    from . import candle_store
+    TauIn = 1440
+    candles = candle_store.load_candles(TauIn, ["logRet", "maxRet"])
+    r = expected_shortfall.construct_overlapping_returns(np.asarray(candles["logRet"]), TauIn, 24*60)
+    r_max = expected_shortfall.construct_overlapping_returns(np.asarray(candles["maxRet"]), TauIn, 24*60)
+    expected_shortfall.h = 0.10
+    expected_shortfall.rateK = 0.02
+    L = expected_shortfall.loss_dist(r, r_max, 0.05)
+    u = np.quantile(L, 0.95)
+
+    fit = fit_tail(L, u)
+    Y = L[L > u] - u
+    t0 = time.perf_counter()
+    [c, _, scale] = genpareto.fit(Y, floc=0)
+    t1 = time.perf_counter()
+    print(f"n_u={fit.num_exceed} xi={fit.xi:.5f} beta={fit.beta:.5f}, "
+          f"scipy xi={c:.5f} beta={scale:.5f} in {t1-t0:.3f}s")
+
+    t0 = time.perf_counter()
+    res = bootstrap_es(L, u, B=2_000, seed=1)
+    print(f"2000 bootstrap refits in {time.perf_counter()-t0:.3f}s")
+    for q, es, lo, hi in zip([0.95, 0.99], res["es"], res["lower"], res["upper"]):
+        print(f"ES {q:.0%}: {es:.4f} [{lo:.4f}, {hi:.4f}], empirical {np.mean(L[L > np.quantile(L, q)]):.4f}")
+
+    for row in threshold_sweep(L, np.unique(np.quantile(L, np.arange(0.90, 0.99, 0.005)))):
+        print(f"u={row['u']:.4f} n_u={row['num_exceed']:4d} e(u)={row['mean_excess']:.4f} "
+              f"xi={row['xi']:+.3f} beta={row['beta']:.4f} ES99={row['es'][1]:.4f}")
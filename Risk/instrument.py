@@ -0,0 +1,176 @@
+# Opt-in stage timing and memory instrumentation
+#
+#   with instrument.stage("bootstrap", replications=B):
+#       ...
+#   @instrument.timed("h' sweep")
+#   def sweep(...): ...
+#
+# Disabled by default: stage() then returns a shared no-op context
+# manager and timed functions call straight through after one flag
+# check. enable() (or the environment variable RISK_TRACE=<file>, or
+# python -m Risk --trace <file>) records every stage with wall time,
+# peak RSS of the process and optionally the tracemalloc peak of the
+# stage (NumPy reports its allocations to tracemalloc). Keyword counts
+# passed to stage() are reported as totals and rates per second, e.g.
+# replications=B gives replications_per_s. save() writes the events in
+# the Chrome trace-event format, which chrome://tracing, Perfetto and
+# speedscope display as a timeline or flame chart.
+
+import atexit
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+_NULL = contextlib.nullcontext()
+
+
+class _State:
+    enabled = False
+    track_alloc = False
+    path = None
+    events = []
+    lock = threading.Lock()
+    local = threading.local()
+    t0 = 0
+
+
+def enabled():
+    return _State.enabled
+
+def enable(path=None, track_alloc=False):
+    """
+    Start recording
+    path : trace file written by save() and at exit, None to keep the
+           events in memory only
+    track_alloc : record the tracemalloc peak per stage (slows NumPy-heavy code)
+    """
+    _State.enabled = True
+    _State.path = path
+    _State.track_alloc = track_alloc
+    _State.events = []
+    _State.t0 = time.perf_counter_ns()
+    if track_alloc and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+def disable():
+    _State.enabled = False
+    if _State.track_alloc and tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def _alloc_stack():
+    if not hasattr(_State.local, "alloc"):
+        _State.local.alloc = []
+    return _State.local.alloc
+
+def _raise_parent_peak(peak):
+    stack = _alloc_stack()
+    if stack:
+        stack[-1] = max(stack[-1], peak)
+
+@contextlib.contextmanager
+def _stage(name, counts):
+    if _State.track_alloc:
+        # fold the peak so far into the enclosing stage, then measure this one
+        _raise_parent_peak(tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+        _alloc_stack().append(0)
+    start = time.perf_counter_ns()
+    try:
+        yield
+    finally:
+        end = time.perf_counter_ns()
+        args = {"peak_rss_mb": _peak_rss_mb()}
+        if _State.track_alloc:
+            peak = max(_alloc_stack().pop(), tracemalloc.get_traced_memory()[1])
+            _raise_parent_peak(peak)
+            tracemalloc.reset_peak()
+            args["alloc_peak_mb"] = peak / 2**20
+        seconds = (end - start) / 1e9
+        for k, v in counts.items():
+            args[k] = v
+            if seconds > 0:
+                args[k + "_per_s"] = v / seconds
+        event = {"name": name, "ph": "X", "pid": os.getpid(), "tid": threading.get_ident(),
+                 "ts": (start - _State.t0) / 1e3, "dur": (end - start) / 1e3, "args": args}
+        with _State.lock:
+            _State.events.append(event)
+
+def stage(name, **counts):
+    """
+    Context manager timing one stage
+    counts : e.g. replications=B, grid_points=G, reported with rates per second
+    """
+    if not _State.enabled:
+        return _NULL
+    return _stage(name, counts)
+
+def timed(name=None):
+    # decorator, stage named after the function by default
+    def decorate(fn):
+        label = name or fn.__qualname__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _State.enabled:
+                return fn(*args, **kwargs)
+            with _stage(label, {}):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def count(name, value):
+    # counter sample, shown as a track in the timeline
+    if not _State.enabled:
+        return
+    event = {"name": name, "ph": "C", "pid": os.getpid(),
+             "ts": (time.perf_counter_ns() - _State.t0) / 1e3, "args": {name: value}}
+    with _State.lock:
+        _State.events.append(event)
+
+def events():
+    return list(_State.events)
+
+def save(path=None):
+    """
+    Write the recorded events as Chrome trace-event JSON
+    return the path written, None if there is nothing to write
+    """
+    path = path or _State.path
+    if path is None or not _State.events:
+        return None
+    trace = {"traceEvents": _State.events, "displayTimeUnit": "ms",
+             "otherData": {"peak_rss_mb": _peak_rss_mb()}}
+    with open(path, "w") as f:
+        json.dump(trace, f, indent=1)
+    return path
+
+def summary():
+    # total time per stage name in seconds, sorted descending
+    totals = {}
+    for e in _State.events:
+        if e["ph"] == "X":
+            totals[e["name"]] = totals.get(e["name"], 0.0) + e["dur"] / 1e6
+    return sorted(totals.items(), key=lambda kv: -kv[1])
+
+def _save_at_exit():
+    if _State.enabled and _State.path:
+        save()
+
+atexit.register(_save_at_exit)
+if os.environ.get("RISK_TRACE"):
+    enable(os.environ["RISK_TRACE"], track_alloc=bool(os.environ.get("RISK_TRACE_ALLOC")))
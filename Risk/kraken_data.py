@@ -1,12 +1,8 @@
 import datetime
-from math import dist
-import requests
-import json
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-from scipy import stats
-import data_roller
+from . import fetcher
+from . import candle_store
 
 #source: https://support.kraken.com/hc/en-us/articles/360047124832-Downloadable-historical-OHLCVT-Open-High-Low-Close-Volume-Trades-data 
 # --> https://drive.google.com/drive/folders/1aoA6SKgPbS_p3pYStXUXFvmjqShJ2jv9
@@ -16,37 +12,59 @@ def load_from_file(tau="60"):
     DF = pd.read_csv("./Risk/XBTCHF_"+str(tau)+".csv", header=0, names = col_names)
     return DF
 
-def load_from_api(since: int, interval=1440):
-    s_query = f"https://api.kraken.com/0/public/OHLC?pair=XBTCHF&interval={interval}&since={since}"
-    response = requests.get(s_query)
-    response._content
-    a_json = json.loads(response._content)
-    df = pd.DataFrame.from_dict(a_json["result"]["XBTCHF"])
-    col_names = ["timestamp", "open", "high", "low", "close", "vwap", "volume", "trades"]
-    df.columns = col_names
-    df.drop(["vwap"], axis = 1, inplace=True)
-    return df
+def load_from_api(since: int, interval=1440, until=None, transport=None):
+    # all candles from since until now (or until), paged and fetched concurrently.
+    # IOError if since lies before the latest 720 candles the API serves,
+    # the older history comes from the downloadable files
+    if until is None:
+        until = int(datetime.datetime.now(datetime.timezone.utc).timestamp())
+    source = fetcher.kraken_source("XBTCHF", interval)
+    return fetcher.fetch(source, since, until, transport=transport)
 
 def merge_data(DF1:pd.DataFrame, DF2:pd.DataFrame) -> pd.DataFrame:
+    # full history with derived columns, see ingest for the incremental update
     DF = pd.concat([DF1, DF2])
-    for k in range(DF.shape[1]):
-        DF.iloc[:, k] = pd.to_numeric(DF.iloc[:, k])
+    DF = DF.apply(pd.to_numeric)
 
-    DF["datetime"] =DF['timestamp'].apply(lambda x: datetime.datetime.utcfromtimestamp(x))
+    DF["datetime"] = pd.to_datetime(DF["timestamp"], unit="s")
     DF["logRet"] = np.log(DF["close"]) - np.log(DF["open"])
     DF["maxRet"] = np.log(DF["high"]) - np.log(DF["open"])
     return DF
 
-tau = "1440"#"60"
-DF = load_from_file(tau)
-since_ts = np.max(DF["timestamp"])
-DF2 = load_from_api(since_ts, interval=1440)
+def ingest(store:candle_store.CandleStore, DF_new:pd.DataFrame, closed_before=None) -> int:
+    """
+    Append new candles to the store
+    store : candle_store.CandleStore
+    DF_new : candles with columns timestamp, open, high, low, close, volume, trades,
+             may overlap with the store and contain duplicates
+    closed_before : unix timestamp, candles not closed by then are skipped
+    return number of appended candles
+    Only rows newer than the store's last timestamp are taken; duplicates
+    keep the last row. Derived returns are computed for these rows only.
+    """
+    DF = DF_new[candle_store.CSV_COLUMNS].apply(pd.to_numeric)
+    hwm = store.last_timestamp()
+    keep = np.ones(DF.shape[0], dtype=bool)
+    if hwm is not None:
+        keep &= DF["timestamp"].to_numpy() > hwm
+    if closed_before is not None:
+        keep &= DF["timestamp"].to_numpy() + store.interval*60 <= closed_before
+    DF = DF[keep].drop_duplicates("timestamp", keep="last").sort_values("timestamp")
+    if DF.shape[0] == 0:
+        return 0
+    data = {c: DF[c].to_numpy() for c in candle_store.CSV_COLUMNS}
+    data.update(candle_store.derived_columns(data["open"], data["high"], data["low"], data["close"]))
+    store.append({c: data[c] for c in (store.columns or data)})
+    return DF.shape[0]
 
-DFmerged = merge_data(DF, DF2)
+if __name__ == "__main__":
+    tau = 1440#60
+    store = candle_store.open_store(tau)
+    now = int(datetime.datetime.now(datetime.timezone.utc).timestamp())
+    DF2 = load_from_api(store.last_timestamp()+1, interval=tau, until=now)
+    num_new = ingest(store, DF2, closed_before=now)
+    print(f"{num_new} new candles, {store.rows} in {store.path}")
 
-#data_roller.analyze_gaps(DFmerged, 1440)
-#data_roller.analyze_returns(DFmerged, 8)
-#data_roller.timeseries_plot(DFmerged)
-# first version was without maxRet
-# third version has data up to May (before end of Jan)
-DFmerged.to_pickle("XBTCHF_"+str(tau)+"_Processed_v3.pkl")
+    #data_roller.analyze_gaps(store.to_frame(), 1440)
+    #data_roller.analyze_returns(store.to_frame(), 8)
+    #data_roller.timeseries_plot(store.to_frame())
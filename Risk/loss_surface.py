@@ -0,0 +1,133 @@
+# Loss surface over the (h', h, rateK, tau) parameter grid
+#
+# For every liquidation duration tau the tau-period return vectors are
+# built once (overlapping windows or a paired block bootstrap) and
+# reused for all (h', h, rateK) grid points. Grid points are evaluated
+# in chunks, broadcasting the chunk against the return vector, so memory
+# is bounded by max_elements and not by the size of the grid.
+
+from dataclasses import dataclass, field
+import numpy as np
+import pandas as pd
+from . import bootstrap
+from . import candle_store
+from . import expected_shortfall
+from . import instrument
+
+DIMS = ("hDash", "h", "rateK", "tau")
+
+
+@dataclass
+class LossSurface:
+    """
+    Labelled result cube, every field has shape (hDash, h, rateK, tau)
+    or (hDash, h, rateK, tau, level)
+    coords : grid values per dimension, including "level"
+    prob_liquidation : probability of liquidation
+    expected_pnl : expected PnL per unit of collateral, E[P|h']
+    loss_quantile : quantile of the loss distribution at each level
+    expected_shortfall : mean loss beyond the quantile at each level
+    """
+    coords: dict
+    prob_liquidation: np.ndarray
+    expected_pnl: np.ndarray
+    loss_quantile: np.ndarray
+    expected_shortfall: np.ndarray
+    dims: tuple = field(default=DIMS)
+
+    def to_frame(self) -> pd.DataFrame:
+        # long table with one row per grid point and level
+        index = pd.MultiIndex.from_product([self.coords[d] for d in self.dims + ("level",)],
+                                           names=self.dims + ("level",))
+        num_lvl = self.coords["level"].shape[0]
+        return pd.DataFrame({
+            "prob_liquidation": np.repeat(self.prob_liquidation.ravel(), num_lvl),
+            "expected_pnl": np.repeat(self.expected_pnl.ravel(), num_lvl),
+            "loss_quantile": self.loss_quantile.ravel(),
+            "expected_shortfall": self.expected_shortfall.ravel()}, index=index)
+
+
+def returns_for_tau(r_in, r_in_max, TauIn, tau, source="overlapping", B=1_000, seed=None):
+    # tau-period log-returns and max-returns as flat vectors
+    # tau : duration for liquidation in hours
+    # source : "overlapping" windows as in expected_shortfall.py or
+    #          "bootstrap" paired block bootstrap as in Estimation.py
+    if source == "overlapping":
+        r = expected_shortfall.construct_overlapping_returns(r_in, TauIn, tau*60)
+        r_max = expected_shortfall.construct_overlapping_returns(r_in_max, TauIn, tau*60)
+    elif source == "bootstrap":
+        sample = bootstrap.sample_pivots(r_in.shape[0], bootstrap.block_length(tau, TauIn), B, seed)
+        r = sample.column(r_in).ravel()
+        r_max = sample.column(r_in_max).ravel()
+    else:
+        raise ValueError("unknown source " + source)
+    return [r, r_max]
+
+def _chunk_stats(r_max, exp_r, hDash, h, rateK, levels):
+    # statistics for a chunk of grid points, hDash, h, rateK of shape (c,)
+    thresh = (np.log(1+h) - np.log(1+hDash))[:, None]
+    D = r_max < thresh
+    L = -(D * ((1+hDash)[:, None]*exp_r - (1+rateK)[:, None]))
+    prob = np.mean(r_max <= thresh, 1)
+    pnl = -np.mean(L, 1)
+    q = np.quantile(L, levels, axis=1).T
+    es = np.zeros(q.shape)
+    for j in range(levels.shape[0]):
+        tail = L > q[:, j:j+1]
+        with np.errstate(invalid='ignore'):
+            es[:, j] = np.sum(L*tail, 1) / np.sum(tail, 1)
+    return [prob, pnl, q, es]
+
+def loss_surface(r_in, r_in_max, TauIn, hDashVec, hVec, rateKVec, tauVec,
+                 levels=(0.95, 0.99), source="overlapping", B=1_000, seed=None,
+                 max_elements=2**24) -> LossSurface:
+    """
+    Evaluate liquidation probability, expected PnL, loss quantiles and
+    Expected Shortfall on the full parameter grid
+    r_in, r_in_max : log-returns close/open and high/open per candle
+    TauIn : candle time in minutes
+    hDashVec, hVec, rateKVec : grids of h', haircut h and challenger fee
+    tauVec : grid of liquidation durations in hours
+    levels : loss quantile and ES levels
+    source, B, seed : see returns_for_tau
+    max_elements : bound on the number of loss values held at once
+    """
+    coords = {"hDash": np.asarray(hDashVec, dtype=float), "h": np.asarray(hVec, dtype=float),
+              "rateK": np.asarray(rateKVec, dtype=float), "tau": np.asarray(tauVec),
+              "level": np.asarray(levels, dtype=float)}
+    grid_shape = tuple(coords[d].shape[0] for d in DIMS[:3])
+    num_lvl = coords["level"].shape[0]
+    shape = grid_shape + (coords["tau"].shape[0],)
+    prob = np.zeros(shape)
+    pnl = np.zeros(shape)
+    q = np.zeros(shape + (num_lvl,))
+    es = np.zeros(shape + (num_lvl,))
+    [hD, hh, kk] = [g.ravel() for g in np.meshgrid(coords["hDash"], coords["h"],
+                                                   coords["rateK"], indexing="ij")]
+    for t in range(coords["tau"].shape[0]):
+        with instrument.stage("returns for tau"):
+            [r, r_max] = returns_for_tau(r_in, r_in_max, TauIn, coords["tau"][t], source, B, seed)
+        exp_r = np.exp(r)
+        chunk = max(1, max_elements // r.shape[0])
+        with instrument.stage("loss surface grid", grid_points=hD.shape[0]):
+            for j in range(0, hD.shape[0], chunk):
+                sel = slice(j, j+chunk)
+                [p, m, qq, ee] = _chunk_stats(r_max, exp_r, hD[sel], hh[sel], kk[sel], coords["level"])
+                idx = np.unravel_index(np.arange(hD.shape[0])[sel], grid_shape) + (t,)
+                prob[idx] = p
+                pnl[idx] = m
+                q[idx] = qq
+                es[idx] = ee
+    return LossSurface(coords, prob, pnl, q, es)
+
+if __name__ == "__main__":
+    TauIn = 1440#60
+    candles = candle_store.load_candles(TauIn, ["logRet", "maxRet"])
+    r_in = np.asarray(candles["logRet"])
+    r_in_max = np.asarray(candles["maxRet"])
+    S = loss_surface(r_in, r_in_max, TauIn,
+                     hDashVec=np.arange(-0.05, 0.25, 0.01),
+                     hVec=np.arange(0.05, 0.31, 0.05),
+                     rateKVec=np.array([0.01, 0.02, 0.03]),
+                     tauVec=np.array([24, 48, 72]))
+    print(S.to_frame())
@@ -0,0 +1,160 @@
+# Content-addressed disk cache for derived arrays
+#
+# An entry is keyed by a SHA-256 over the bytes, dtype and shape of the
+# input arrays (e.g. candle columns) and the JSON of the parameters
+# (TauIn, tau, B, seed, method, ...). Changed candle data therefore
+# changes the key and old entries are never hit again. Each entry is a
+# folder <key> with one .npy file per result array, opened with
+# np.load(mmap_mode="r"), and a meta.json whose modification time is
+# the last use. When the cache grows beyond max_bytes, the least
+# recently used entries are deleted; the entry just written is kept,
+# unless it alone exceeds max_bytes and is returned uncached.
+#
+# The key does not see the code that produced a result. CACHE_VERSION
+# is hashed into every key and must be increased with every change that
+# alters cached results, so that older entries are no longer hit.
+# Caching is opt-in for the analysis scripts: python -m Risk --cache
+# <command> or the environment variable RISK_CACHE=1.
+
+import hashlib
+import json
+import os
+import shutil
+import time
+import numpy as np
+
+CACHE_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache")
+MAX_BYTES = 2 * 1024**3
+# increase when a code change alters cached results
+CACHE_VERSION = 2
+
+
+def enabled():
+    # caching requested with RISK_CACHE=1 (python -m Risk --cache)
+    return os.environ.get("RISK_CACHE", "") not in ("", "0")
+
+
+def cache_key(arrays, params):
+    """
+    Hash of input arrays, parameters and CACHE_VERSION
+    arrays : list of arrays the result is computed from
+    params : JSON-serializable dict, numpy scalars and arrays are converted
+    """
+    h = hashlib.sha256()
+    for a in arrays:
+        a = np.ascontiguousarray(a)
+        h.update(f"{a.dtype.str}{a.shape}".encode())
+        h.update(memoryview(a).cast("B"))
+    h.update(json.dumps({"cache_version": CACHE_VERSION, "params": params},
+                        sort_keys=True, default=_json_default).encode())
+    return h.hexdigest()
+
+def _json_default(x):
+    if isinstance(x, np.ndarray):
+        return x.tolist()
+    if isinstance(x, np.generic):
+        return x.item()
+    raise TypeError(f"{type(x)} is not JSON serializable")
+
+def _dir_size(path):
+    return sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+
+
+class ResultCache:
+    def __init__(self, root=CACHE_ROOT, max_bytes=MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+
+    def _path(self, key):
+        return os.path.join(self.root, key)
+
+    def get(self, key):
+        # {name: read-only memmap} or None, marks the entry as used
+        path = self._path(key)
+        meta = os.path.join(path, "meta.json")
+        if not os.path.exists(meta):
+            return None
+        with open(meta) as f:
+            names = json.load(f)["arrays"]
+        os.utime(meta)
+        return {n: np.load(os.path.join(path, n + ".npy"), mmap_mode="r") for n in names}
+
+    def put(self, key, arrays, params=None):
+        # store {name: array}, written to a temporary folder and renamed;
+        # returns the stored memmaps, or arrays itself if the entry alone
+        # exceeds max_bytes and is not kept
+        os.makedirs(self.root, exist_ok=True)
+        tmp = self._path(f"{key}.{os.getpid()}.tmp")
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        for n, a in arrays.items():
+            np.save(os.path.join(tmp, n + ".npy"), np.asarray(a))
+        with open(os.path.join(tmp, "meta.json"), "w") as f:
+            json.dump({"arrays": list(arrays), "params": params,
+                       "cache_version": CACHE_VERSION, "created": time.time()},
+                      f, indent=1, default=_json_default)
+        path = self._path(key)
+        if os.path.exists(path):
+            shutil.rmtree(tmp)
+        else:
+            os.replace(tmp, path)
+        if _dir_size(path) > self.max_bytes:
+            shutil.rmtree(path, ignore_errors=True)
+            return arrays
+        self.evict(keep=key)
+        return self.get(key)
+
+    def entries(self):
+        # [(last use, size in bytes, key)] sorted by last use
+        if not os.path.isdir(self.root):
+            return []
+        res = []
+        for key in os.listdir(self.root):
+            meta = os.path.join(self.root, key, "meta.json")
+            if key.endswith(".tmp") or not os.path.exists(meta):
+                continue
+            res.append((os.path.getmtime(meta), _dir_size(self._path(key)), key))
+        return sorted(res)
+
+    def evict(self, max_bytes=None, keep=None):
+        # delete least recently used entries until the total size fits,
+        # never the entry keep
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        entries = self.entries()
+        total = sum(size for (_, size, _) in entries)
+        for (_, size, key) in entries:
+            if total <= max_bytes:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(self._path(key), ignore_errors=True)
+            total -= size
+        return total
+
+    def cached(self, arrays, params, compute):
+        """
+        Result for inputs and parameters, computed on a miss
+        arrays, params : see cache_key
+        compute : () -> {name: array}
+        return {name: read-only memmap}, or the computed arrays if they
+               are too large to be cached
+        """
+        key = cache_key(arrays, params)
+        res = self.get(key)
+        if res is None:
+            res = self.put(key, compute(), params)
+        return res
+
+if __name__ == "__main__":
+    from . import candle_store
+    from . import expected_shortfall
+    TauIn = 60
+    r_in = np.asarray(candle_store.load_candles(TauIn, ["logRet"])["logRet"])
+    cache = ResultCache()
+    params = {"TauIn": TauIn, "tau_min": 24*60, "method": "overlapping"}
+    for run in range(2):
+        t0 = time.perf_counter()
+        res = cache.cached([r_in], params, lambda: {
+            "r": expected_shortfall.construct_overlapping_returns(r_in, TauIn, 24*60)})
+        print(f"run {run}: {res['r'].shape[0]} returns in {1000*(time.perf_counter()-t0):.1f}ms")
+    print(f"{len(cache.entries())} entries, {cache.evict()/1024**2:.1f} MB")
@@ -0,0 +1,69 @@
+# Rolling-window aggregation of return series
+#
+# Rolling sums are read from a prefix sum and the rolling maximum uses
+# the van Herk/Gil-Werman block scheme, both O(n) independent of the
+# window length. With wrap=True windows run over the end of the series
+# into its start, which is the circular indexing of the block bootstrap.
+
+import numpy as np
+
+
+def _wrap(x, m):
+    # x extended cyclically so that every start 0..n-1 has a full window
+    return np.resize(x, x.shape[0] + m - 1)
+
+def rolling_sum(r : np.array, m : int, wrap=False) -> np.array:
+    """
+    Sum over windows of m consecutive observations
+    r : vector of (log-)returns
+    m : window length
+    wrap : windows wrap around the end of r
+    return out[i] = sum(r[i:i+m]), length n-m+1, or n if wrap
+    """
+    if wrap:
+        r = _wrap(r, m)
+    r0 = np.zeros(r.shape[0]+1)
+    np.cumsum(r, out=r0[1:])
+    return r0[m:] - r0[:r0.shape[0]-m]
+
+def rolling_max(x : np.array, m : int, wrap=False) -> np.array:
+    """
+    Maximum over windows of m consecutive observations
+    x : vector
+    m : window length
+    wrap : windows wrap around the end of x
+    return out[i] = max(x[i:i+m]), length n-m+1, or n if wrap
+    """
+    if wrap:
+        x = _wrap(x, m)
+    x = np.asarray(x, dtype=float)
+    n = x.shape[0]
+    if m == 1:
+        return x.copy()
+    # split into blocks of length m: a window covers the tail of one block
+    # and the head of the next, read from suffix and prefix maxima
+    pad = (-n) % m
+    xb = np.concatenate((x, np.full(pad, -np.inf))).reshape(-1, m)
+    prefix_max = np.maximum.accumulate(xb, 1).ravel()
+    suffix_max = np.maximum.accumulate(xb[:, ::-1], 1)[:, ::-1].ravel()
+    i = np.arange(n-m+1)
+    return np.maximum(suffix_max[i], prefix_max[i+m-1])
+
+def rolling_path_max(r : np.array, r_max : np.array, m : int, wrap=False) -> np.array:
+    """
+    Running maximum of the cumulative log-price path within each window,
+    relative to the price at the window start
+    r : log-returns close/open per candle
+    r_max : log-returns high/open per candle
+    m : window length
+    wrap : windows wrap around the end of the series
+    return out[i] = max_{j<m} (sum(r[i:i+j]) + r_max[i+j])
+    """
+    if wrap:
+        r = _wrap(r, m)
+        r_max = _wrap(r_max, m)
+    r0 = np.zeros(r.shape[0]+1)
+    np.cumsum(r, out=r0[1:])
+    # path level at the high of candle j, measured from the series start
+    level_high = r0[:r.shape[0]] + r_max
+    return rolling_max(level_high, m) - r0[:r.shape[0]-m+1]
@@ -0,0 +1,191 @@
+# Interest accrual of the Savings module for many accounts
+#
+# Leadrate integrates the rate over time into ticks (ppm * seconds).
+# Between two applyChange calls the rate is constant, so the ticks are
+# a piecewise linear function of time: the change times, rates and the
+# cumulative ticks at each change are precomputed once and ticks(t) is
+# one searchsorted and a multiply-add for any number of timestamps.
+# Accounts are column arrays of the saved amount and the ticks anchor of
+# Savings.Account; Savings.calculateInterest is then a difference of
+# ticks times the balance.
+#
+# LeadrateModel replays proposeChange/applyChange call by call with the
+# contract's integer arithmetic and is used to check the vectorized
+# engine.
+
+from dataclasses import dataclass
+import numpy as np
+
+ONE_DEC18 = 10**18
+YEAR = 365 * 24 * 3600
+INTEREST_DELAY = 3 * 24 * 3600
+CHANGE_DELAY = 7 * 24 * 3600
+
+
+class LeadrateModel:
+    # contracts/Leadrate.sol, one call at a time, integer arithmetic
+    def __init__(self, t0, rate_ppm):
+        self.currentRatePPM = int(rate_ppm)
+        self.nextRatePPM = int(rate_ppm)
+        self.nextChange = int(t0)
+        self.anchorTime = int(t0)
+        self.ticksAnchor = 0
+        self.changes = [(int(t0), int(rate_ppm))]
+
+    def propose_change(self, t, rate_ppm):
+        self.nextRatePPM = int(rate_ppm)
+        self.nextChange = int(t) + CHANGE_DELAY
+
+    def apply_change(self, t):
+        # return False where the contract reverts
+        if self.currentRatePPM == self.nextRatePPM or t < self.nextChange:
+            return False
+        self.ticksAnchor += (int(t) - self.anchorTime) * self.currentRatePPM
+        self.anchorTime = int(t)
+        self.currentRatePPM = self.nextRatePPM
+        self.changes.append((int(t), self.currentRatePPM))
+        return True
+
+    def ticks(self, t):
+        return self.ticksAnchor + (int(t) - self.anchorTime) * self.currentRatePPM
+
+
+class RateSchedule:
+    """
+    Piecewise constant lead rate
+    times : applyChange timestamps in seconds, the first one is the deployment
+    rates : rate in ppm from each time on
+    """
+    def __init__(self, times, rates):
+        self.times = np.asarray(times, dtype=np.int64)
+        self.rates = np.asarray(rates, dtype=np.int64)
+        if np.any(np.diff(self.times) < 0):
+            raise ValueError("change times must be sorted")
+        # ticksAnchor after each change
+        self.cum_ticks = np.concatenate(([0], np.cumsum(np.diff(self.times) * self.rates[:-1])))
+
+    @classmethod
+    def from_calls(cls, t0, rate_ppm, calls):
+        """
+        Schedule resulting from a sequence of governance calls
+        calls : [(t, "propose", rate_ppm) or (t, "apply", None)] sorted by t,
+                reverting applyChange calls are skipped
+        """
+        model = LeadrateModel(t0, rate_ppm)
+        for (t, kind, rate) in calls:
+            if kind == "propose":
+                model.propose_change(t, rate)
+            else:
+                model.apply_change(t)
+        [times, rates] = zip(*model.changes)
+        return cls(times, rates)
+
+    def _segment(self, t):
+        return np.maximum(np.searchsorted(self.times, t, side="right") - 1, 0)
+
+    def rate(self, t):
+        # currentRatePPM at timestamps t
+        return self.rates[self._segment(np.asarray(t, dtype=np.int64))]
+
+    def ticks(self, t):
+        # Leadrate.ticks at timestamps t >= times[0]
+        t = np.asarray(t, dtype=np.int64)
+        k = self._segment(t)
+        return self.cum_ticks[k] + (t - self.times[k]) * self.rates[k]
+
+
+@dataclass
+class Accounts:
+    """
+    Savings accounts as columns
+    saved : saved amount, object array of integers with 18 decimals
+    ticks : ticks anchor of each account, int64
+    """
+    saved: np.ndarray
+    ticks: np.ndarray
+
+    @classmethod
+    def from_deposits(cls, schedule, amounts, timestamps):
+        # fresh accounts after one Savings.save each, with the interest delay
+        t = np.asarray(timestamps, dtype=np.int64)
+        anchor = schedule.ticks(t) + schedule.rate(t) * INTEREST_DELAY
+        return cls(np.asarray(amounts, dtype=object), anchor.astype(np.int64))
+
+def accrued_interest(schedule, accounts, timestamp, equity=None, exact=False):
+    """
+    Savings.calculateInterest of every account at one timestamp
+    equity : cap of the interest per account (Frankencoin.equity), None for no cap
+    exact : integer arithmetic as in the contract, otherwise float64 in ZCHF units
+    return interest per account, object array with 18 decimals if exact
+    """
+    dticks = schedule.ticks(timestamp) - accounts.ticks
+    active = (dticks > 0) & (accounts.ticks != 0)
+    if exact:
+        d = np.where(active, dticks, 0).astype(object)
+        interest = d * accounts.saved // 1_000_000 // YEAR
+        return interest if equity is None else np.minimum(interest, int(equity))
+    saved = accounts.saved.astype(float) / ONE_DEC18
+    interest = np.where(active, dticks, 0) * saved / 1e6 / YEAR
+    return interest if equity is None else np.minimum(interest, equity / ONE_DEC18)
+
+def interest_liability(schedule, accounts, timestamps):
+    """
+    Total accrued interest over all accounts at many timestamps, float64 ZCHF
+    Accounts are sorted by their anchor once; at a timestamp with ticks T
+    the total is T * sum(saved) - sum(saved * anchor) over the accounts with
+    anchor < T, read from prefix sums with one searchsorted.
+    """
+    valid = accounts.ticks != 0
+    order = np.argsort(accounts.ticks[valid])
+    anchor = accounts.ticks[valid][order]
+    saved = accounts.saved[valid][order].astype(float) / ONE_DEC18
+    S = np.concatenate(([0.0], np.cumsum(saved)))
+    SA = np.concatenate(([0.0], np.cumsum(saved * anchor)))
+    T = schedule.ticks(timestamps)
+    k = np.searchsorted(anchor, T, side="left")
+    return (T * S[k] - SA[k]) / 1e6 / YEAR
+
+if __name__ == "__main__":
+    import time
+    rng = np.random.default_rng(1)
+    t0 = 1_700_000_000
+    day = 24 * 3600
+    # rate proposals every quarter, applied as soon as possible
+    calls = []
+    for q, rate in enumerate([35_000, 50_000, 20_000, 20_000, 40_000]):
+        t = t0 + (q+1) * 91 * day
+        calls += [(t, "propose", rate), (t + CHANGE_DELAY, "apply", None)]
+    schedule = RateSchedule.from_calls(t0, 30_000, calls)
+    print("rates", schedule.rates.tolist())
+
+    # check against the call-by-call model
+    model = LeadrateModel(t0, 30_000)
+    ts = np.sort(rng.integers(t0, t0 + 2 * YEAR, 10_000))
+    expected = []
+    pending = list(calls)
+    for t in ts:
+        while pending and pending[0][0] <= t:
+            (tc, kind, rate) = pending.pop(0)
+            model.propose_change(tc, rate) if kind == "propose" else model.apply_change(tc)
+        expected.append(model.ticks(t))
+    print("ticks equal to model:", np.array_equal(schedule.ticks(ts), np.array(expected)))
+
+    num = 500_000
+    amounts = np.array([int(x) * 10**12 for x in rng.lognormal(np.log(5_000), 1.5, num) * 1e6], dtype=object)
+    accounts = Accounts.from_deposits(schedule, amounts, rng.integers(t0, t0 + YEAR, num))
+    t_eval = t0 + YEAR + 30 * day
+    t1 = time.perf_counter()
+    exact = accrued_interest(schedule, accounts, t_eval, exact=True)
+    t2 = time.perf_counter()
+    approx = accrued_interest(schedule, accounts, t_eval)
+    t3 = time.perf_counter()
+    # contract formula account by account
+    T = int(schedule.ticks(t_eval))
+    ref = [(T - int(a)) * s // 1_000_000 // YEAR if T > a else 0 for s, a in zip(accounts.saved, accounts.ticks)]
+    print(f"exact interest equal to contract: {np.array_equal(exact, np.array(ref, dtype=object))}, "
+          f"{t2-t1:.2f}s exact, {t3-t2:.3f}s float for {num} accounts")
+    grid = t0 + np.arange(0, 2 * YEAR, day)
+    t4 = time.perf_counter()
+    L = interest_liability(schedule, accounts, grid)
+    print(f"liability on {grid.shape[0]} days in {time.perf_counter()-t4:.3f}s, "
+          f"at t_eval {interest_liability(schedule, accounts, [t_eval])[0]:.0f} vs sum {np.sum(approx):.0f} ZCHF")
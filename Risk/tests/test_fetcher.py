@@ -0,0 +1,39 @@
+# Fetcher against the local Kraken fixture
+#
+#   python -m pytest Risk/tests
+
+import dataclasses
+import numpy as np
+import pytest
+from Risk import fetcher
+
+DAY = 86400
+
+
+def _candle_file(tmp_path, num, drop=()):
+    rng = np.random.default_rng(0)
+    close = 30000 * np.exp(np.cumsum(0.02 * rng.standard_normal(num)))
+    M = np.column_stack([18000*DAY + DAY*np.arange(num), close, close*1.01, close*0.99, close,
+                         rng.uniform(1, 10, num), rng.integers(1, 100, num)])
+    M = np.delete(M, list(drop), axis=0)
+    path = tmp_path / "candles.csv"
+    np.savetxt(path, M, delimiter=",")
+    return [str(path), M]
+
+def _fetch(srv, M, page_size, history=fetcher.KRAKEN_HISTORY):
+    source = fetcher.kraken_source("XBTCHF", 1440, srv.url, page_size)
+    source = dataclasses.replace(source, max_history=history)
+    return fetcher.fetch(source, int(M[0, 0]), int(M[-1, 0])+1, workers=4, rate=None, retries=0)
+
+def test_gap_at_page_boundary(tmp_path):
+    # the second page [50, 100) starts inside a gap of five days
+    [path, M] = _candle_file(tmp_path, 300, drop=range(48, 53))
+    with fetcher.FixtureServer({("XBTCHF", 1440): path}) as srv:
+        DF = _fetch(srv, M, 50)
+    assert np.allclose(DF[fetcher.CANDLE_COLUMNS].to_numpy(dtype=float), M)
+
+def test_history_limit(tmp_path):
+    [path, M] = _candle_file(tmp_path, 300)
+    with fetcher.FixtureServer({("XBTCHF", 1440): path}, page_size=100, history=100) as srv:
+        with pytest.raises(IOError, match="latest 100 candles"):
+            _fetch(srv, M, 50, history=100)
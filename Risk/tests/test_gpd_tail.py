@@ -0,0 +1,41 @@
+# GPD tail fit against scipy
+#
+#   python -m pytest Risk/tests
+
+import numpy as np
+import pytest
+from Risk import gpd_tail
+
+genpareto = pytest.importorskip("scipy.stats").genpareto
+
+
+def _loglik(Y, xi, beta):
+    return np.sum(genpareto.logpdf(Y, xi, 0, beta))
+
+@pytest.mark.parametrize("xi", [-0.4, -0.2, 0.0, 0.2, 0.5, 0.8])
+def test_small_samples_reach_scipy_likelihood(xi):
+    rng = np.random.default_rng(int(10*xi) + 10)
+    for _ in range(20):
+        Y = genpareto.rvs(xi, 0, 1, size=rng.integers(30, 81), random_state=rng)
+        [xi_fit, beta_fit] = gpd_tail.mle_fit(Y)
+        [c, _, scale] = genpareto.fit(Y, floc=0)
+        if c < -1:
+            # likelihood unbounded there, the fit stops at the boundary
+            assert xi_fit[0] == pytest.approx(-1)
+            continue
+        assert _loglik(Y, xi_fit[0], beta_fit[0]) >= _loglik(Y, c, scale) - 1e-6
+
+def test_rows_are_fitted_independently():
+    rng = np.random.default_rng(0)
+    Y = genpareto.rvs(0.3, 0, 1, size=(5, 50), random_state=rng)
+    [xi, beta] = gpd_tail.mle_fit(Y)
+    for j in range(5):
+        [xi_j, beta_j] = gpd_tail.mle_fit(Y[j])
+        assert [xi[j], beta[j]] == pytest.approx([xi_j[0], beta_j[0]])
+
+def test_constant_excesses():
+    with np.errstate(all="raise"):
+        [xi, beta] = gpd_tail.pwm_fit(np.full((2, 10), 0.3))
+    assert np.all(np.isfinite(xi)) and np.all(np.isfinite(beta))
+    [xi, beta] = gpd_tail.mle_fit(np.full(10, 0.3))
+    assert np.isfinite(xi[0]) and beta[0] > 0
@@ -0,0 +1,38 @@
+# Rolling VaR/ES backtest
+#
+#   python -m pytest Risk/tests
+
+import warnings
+import numpy as np
+import pytest
+from Risk import var_backtest
+
+
+def _returns(n, seed=0):
+    return 0.03 * np.random.default_rng(seed).standard_t(4, n)
+
+def test_rolling_var_es_matches_sorting():
+    R = _returns(300)
+    res = var_backtest.rolling_var_es(R, [50], [0.95])
+    [var, es] = res[(50, 0.95)]
+    for t in range(49, 300):
+        window = R[t-49:t+1]
+        assert var[t] == pytest.approx(np.quantile(window, 0.05))
+        k = int(np.ceil(0.05 * 50))
+        assert es[t] == pytest.approx(np.mean(np.sort(window)[:k]))
+
+def test_window_covering_the_series():
+    # 100 daily returns, a 100 day window leaves nothing out of sample
+    r = _returns(100)
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        [_, summary] = var_backtest.backtest(r, 1440, 1, [30, 100], levels=(0.99,))
+    full = summary[summary["window_days"] == 100].iloc[0]
+    assert full["num_obs"] == 0 and full["exceedances"] == 0
+    assert np.isnan(full[["rate", "mean_es", "LR_uc", "p_uc", "LR_ind", "p_ind",
+                          "LR_cc", "p_cc"]].to_numpy(dtype=float)).all()
+    assert summary[summary["window_days"] == 30].iloc[0]["num_obs"] > 0
+
+def test_exceedance_tests_without_observations():
+    assert np.isnan(var_backtest.kupiec_test([], 0.99)).all()
+    assert np.isnan(var_backtest.christoffersen_test([True], 0.99)).all()
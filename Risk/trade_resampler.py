@@ -0,0 +1,112 @@
+# Streaming resampler from raw trades to candles
+#
+# Kraken's trade dumps are csv files with one trade per line,
+# "timestamp,price,volume", sorted by time. The file is read in chunks
+# of lines and each chunk is reduced to candles with reduceat. The last,
+# possibly incomplete candle of a chunk is carried into the next chunk,
+# so memory is bounded by the chunk size and every candle is written
+# exactly once. Candles go directly into the candle store, including
+# the derived logRet, maxRet and minRet columns. Intervals without
+# trades produce no candle (see data_roller.gap_report).
+
+import argparse
+import numpy as np
+from . import candle_store
+
+CHUNK_BYTES = 1 << 26
+
+
+def _candles(ts, price, volume, step):
+    # OHLCV per interval for trades sorted by time
+    bucket = ts // step
+    n = bucket.shape[0]
+    starts = np.flatnonzero(np.concatenate(([True], bucket[1:] != bucket[:-1])))
+    ends = np.concatenate((starts[1:], [n])) - 1
+    return {"bucket": bucket[starts],
+            "open": price[starts],
+            "high": np.maximum.reduceat(price, starts),
+            "low": np.minimum.reduceat(price, starts),
+            "close": price[ends],
+            "volume": np.add.reduceat(volume, starts),
+            "trades": np.diff(np.concatenate((starts, [n])))}
+
+def _merge_carry(carry, C):
+    # continue the carried candle with the first candle of the chunk
+    if carry is None:
+        return C
+    if carry["bucket"][0] > C["bucket"][0]:
+        raise ValueError("trades are not sorted by time")
+    if carry["bucket"][0] < C["bucket"][0]:
+        return {k: np.concatenate((carry[k], C[k])) for k in C}
+    C["open"][0] = carry["open"][0]
+    C["high"][0] = max(C["high"][0], carry["high"][0])
+    C["low"][0] = min(C["low"][0], carry["low"][0])
+    C["volume"][0] += carry["volume"][0]
+    C["trades"][0] += carry["trades"][0]
+    return C
+
+def _to_columns(C, step):
+    data = {"timestamp": C["bucket"] * step}
+    for k in ["open", "high", "low", "close", "volume", "trades"]:
+        data[k] = C[k]
+    data.update(candle_store.derived_columns(C["open"], C["high"], C["low"], C["close"]))
+    return data
+
+def resample_trades(path, interval, pair="XBTCHF", root=candle_store.STORE_ROOT,
+                    append=False, chunk_bytes=CHUNK_BYTES):
+    """
+    Build candles of any interval from a trades csv in one streaming pass
+    path : csv with lines "timestamp,price,volume", sorted by timestamp
+    interval : candle time in minutes
+    pair, root : target candle store
+    append : append candles after the store's last timestamp instead of
+             replacing the store
+    chunk_bytes : approximate size of the chunk of lines read at once
+    return the candle store
+    """
+    step = int(interval) * 60
+    store = candle_store.CandleStore(pair, interval, root)
+    hwm = store.last_timestamp() if append else None
+    first_write = not append
+    carry = None
+
+    def emit(C):
+        nonlocal first_write
+        data = _to_columns(C, step)
+        if hwm is not None:
+            keep = data["timestamp"] > hwm
+            data = {k: v[keep] for k, v in data.items()}
+        if data["timestamp"].shape[0] == 0:
+            return
+        if first_write:
+            store.write(data)
+            first_write = False
+        else:
+            store.append({c: data[c] for c in (store.columns or data)})
+
+    with open(path) as f:
+        while True:
+            lines = f.readlines(chunk_bytes)
+            if len(lines) == 0:
+                break
+            M = np.loadtxt(lines, delimiter=",", usecols=(0, 1, 2), ndmin=2)
+            ts = M[:, 0].astype(np.int64)
+            order = np.argsort(ts, kind="stable")
+            C = _candles(ts[order], M[order, 1], M[order, 2], step)
+            C = _merge_carry(carry, C)
+            carry = {k: v[-1:] for k, v in C.items()}
+            if C["bucket"].shape[0] > 1:
+                emit({k: v[:-1] for k, v in C.items()})
+    if carry is not None:
+        emit(carry)
+    return store
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="resample Kraken trades to candles")
+    parser.add_argument("path", help="trades csv, e.g. XBTCHF.csv")
+    parser.add_argument("interval", type=int, help="candle time in minutes")
+    parser.add_argument("--pair", default="XBTCHF")
+    parser.add_argument("--append", action="store_true")
+    args = parser.parse_args()
+    store = resample_trades(args.path, args.interval, args.pair, append=args.append)
+    print(f"{store.rows} candles in {store.path}")
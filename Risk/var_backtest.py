@@ -0,0 +1,199 @@
+# Rolling VaR/ES backtest
+#
+# Horizon returns R are built with VaR.roll_window. For every lookback
+# window the order statistics of the last w horizon returns are kept in
+# a Fenwick tree over the ranks of all returns (counts and sums), so
+# sliding the window by one is one insert and one delete, and the
+# quantile and the sum of the k smallest returns are found by binary
+# lifting, O(log n) per update and query instead of sorting every
+# window. Every window length is one pass over the series, in which all
+# levels are evaluated.
+#
+# The forecast made with the window ending at R[t] is compared with the
+# next horizon return that does not overlap it, R[t+h]. For h > 1 the
+# exceedances of consecutive days overlap and are not independent,
+# which the exceedance tests below do not account for.
+
+import math
+import numpy as np
+import pandas as pd
+from . import VaR
+
+
+class _OrderStatTree:
+    # Fenwick tree over ranks 1..n holding counts and value sums
+    def __init__(self, values_by_rank):
+        self.vals = values_by_rank
+        self.n = len(values_by_rank)
+        self.cnt = [0] * (self.n + 1)
+        self.sum = [0.0] * (self.n + 1)
+        self.top = 1 << (self.n.bit_length() - 1)
+
+    def update(self, rank, sign):
+        v = sign * self.vals[rank - 1]
+        while rank <= self.n:
+            self.cnt[rank] += sign
+            self.sum[rank] += v
+            rank += rank & -rank
+
+    def smallest(self, k):
+        # [k-th smallest value, sum of the k smallest values], k >= 1
+        pos = 0
+        acc = 0.0
+        step = self.top
+        while step > 0:
+            nxt = pos + step
+            if nxt <= self.n and self.cnt[nxt] < k:
+                pos = nxt
+                k -= self.cnt[nxt]
+                acc += self.sum[nxt]
+            step >>= 1
+        return [self.vals[pos], acc + self.vals[pos]]
+
+    def kth(self, k):
+        return self.smallest(k)[0]
+
+
+def rolling_var_es(R, windows, levels):
+    """
+    Rolling quantile and Expected Shortfall of the left tail
+    R : horizon returns
+    windows : lookback lengths in number of returns
+    levels : confidence levels, e.g. 0.99 for the 1% quantile
+    return {(w, level): [var, es]} arrays of length len(R), nan until the
+           window is full. var is np.quantile(window, 1-level) (linear
+           interpolation), es the mean of the ceil((1-level)*w) smallest
+           returns in the window
+    """
+    R = np.asarray(R, dtype=float)
+    n = R.shape[0]
+    order = np.argsort(R, kind="stable")
+    rank = np.empty(n, dtype=np.int64)
+    rank[order] = np.arange(1, n+1)
+    vals = R[order].tolist()
+    rank = rank.tolist()
+    out = {}
+    for w in windows:
+        tree = _OrderStatTree(vals)
+        var = {lvl: np.full(n, np.nan) for lvl in levels}
+        es = {lvl: np.full(n, np.nan) for lvl in levels}
+        spec = []
+        for lvl in levels:
+            p = (1-lvl) * (w-1)
+            spec.append((lvl, int(p), p - int(p), max(1, math.ceil((1-lvl)*w))))
+        for t in range(n):
+            tree.update(rank[t], 1)
+            if t >= w:
+                tree.update(rank[t-w], -1)
+            if t < w-1:
+                continue
+            for (lvl, j, frac, k_es) in spec:
+                lo = tree.kth(j+1)
+                hi = tree.kth(j+2) if frac > 0 else lo
+                var[lvl][t] = lo + frac*(hi - lo)
+                es[lvl][t] = tree.smallest(k_es)[1] / k_es
+        for lvl in levels:
+            out[(w, lvl)] = [var[lvl], es[lvl]]
+    return out
+
+def kupiec_test(exceed, level):
+    """
+    Unconditional coverage likelihood ratio test
+    exceed : boolean exceedances
+    return [LR statistic, p-value], chi-squared with 1 degree of freedom,
+           nan without observations
+    """
+    exceed = np.asarray(exceed, dtype=bool)
+    n = exceed.shape[0]
+    if n == 0:
+        return [np.nan, np.nan]
+    x = int(np.sum(exceed))
+    p = 1-level
+    pi = x/n
+    ll0 = (n-x)*math.log(1-p) + x*math.log(p)
+    ll1 = (n-x)*math.log(1-pi) if x < n else 0.0
+    ll1 += x*math.log(pi) if x > 0 else 0.0
+    lr = max(-2*(ll0 - ll1), 0.0)
+    return [lr, math.erfc(math.sqrt(lr/2))]
+
+def christoffersen_test(exceed, level):
+    """
+    Independence and conditional coverage tests of Christoffersen (1998)
+    return [LR_ind, p-value ind, LR_cc, p-value cc], nan with fewer than
+           two observations
+    """
+    e = np.asarray(exceed, dtype=int)
+    if e.shape[0] < 2:
+        return [np.nan] * 4
+    prev = e[:-1]
+    curr = e[1:]
+    n = np.array([[np.sum((prev == i) & (curr == j)) for j in (0, 1)] for i in (0, 1)])
+
+    def ll(counts, probs):
+        return sum(c*math.log(q) for c, q in zip(counts, probs) if c > 0)
+
+    pi01 = n[0, 1]/max(n[0].sum(), 1)
+    pi11 = n[1, 1]/max(n[1].sum(), 1)
+    pi = (n[0, 1]+n[1, 1])/max(n.sum(), 1)
+    ll_ind = ll([n[0, 0], n[0, 1], n[1, 0], n[1, 1]], [1-pi01, pi01, 1-pi11, pi11])
+    ll_dep = ll([n[0, 0]+n[1, 0], n[0, 1]+n[1, 1]], [1-pi, pi])
+    lr_ind = max(-2*(ll_dep - ll_ind), 0.0)
+    lr_cc = kupiec_test(e[1:], level)[0] + lr_ind
+    return [lr_ind, math.erfc(math.sqrt(lr_ind/2)), lr_cc, math.exp(-lr_cc/2)]
+
+def backtest(r, TauIn, horizon_days, windows_days, levels=(0.99, 0.975)):
+    """
+    Daily or hourly rolling VaR/ES backtest
+    r : log-returns per candle
+    TauIn : candle time in minutes
+    horizon_days : return horizon, e.g. 5 as in VaR.py
+    windows_days : lookback windows, e.g. [365]
+    return [series, summary]: series is a DataFrame indexed by the candle
+           with columns (window_days, level, var|es|realized|exceed), summary
+           one row per window and level with the exceedance rate and tests;
+           a window covering the whole series leaves no observations to test
+           and its row holds nan statistics
+    """
+    per_day = 1440 // TauIn
+    h = int(horizon_days * per_day)
+    R = VaR.roll_window(np.asarray(r, dtype=float), h)
+    windows = [int(d * per_day) for d in windows_days]
+    res = rolling_var_es(R, windows, levels)
+    realized = np.full(R.shape[0], np.nan)
+    realized[:R.shape[0]-h] = R[h:]
+    cols = {}
+    rows = []
+    for d, w in zip(windows_days, windows):
+        for lvl in levels:
+            [var, es] = res[(w, lvl)]
+            valid = ~np.isnan(var) & ~np.isnan(realized)
+            exceed = realized < var
+            cols[(d, lvl, "var")] = var
+            cols[(d, lvl, "es")] = es
+            cols[(d, lvl, "realized")] = realized
+            cols[(d, lvl, "exceed")] = np.where(valid, exceed, False)
+            e = exceed[valid]
+            [lr_uc, p_uc] = kupiec_test(e, lvl)
+            [lr_ind, p_ind, lr_cc, p_cc] = christoffersen_test(e, lvl)
+            n = e.shape[0]
+            rows.append({"window_days": d, "level": lvl, "num_obs": n,
+                         "exceedances": int(np.sum(e)), "rate": np.mean(e) if n else np.nan,
+                         "expected": 1-lvl, "mean_es": np.mean(es[valid]) if n else np.nan,
+                         "mean_realized_beyond_var": np.mean(realized[valid][e]) if np.any(e) else np.nan,
+                         "LR_uc": lr_uc, "p_uc": p_uc, "LR_ind": lr_ind, "p_ind": p_ind,
+                         "LR_cc": lr_cc, "p_cc": p_cc})
+    series = pd.DataFrame(cols)
+    series.columns = pd.MultiIndex.from_tuples(series.columns, names=["window_days", "level", "field"])
+    return [series, pd.DataFrame(rows)]
+
+if __name__ == "__main__":
+    import time
+    from . import candle_store
+    for TauIn in [1440, 60]:
+        r = np.asarray(candle_store.load_candles(TauIn, ["logRet"])["logRet"])
+        t0 = time.perf_counter()
+        horizon = 5 if TauIn == 1440 else 1
+        [series, summary] = backtest(r, TauIn, horizon, [90, 365], levels=(0.99, 0.975))
+        print(f"TauIn={TauIn}: {r.shape[0]} returns in {time.perf_counter()-t0:.2f}s")
+        with pd.option_context("display.max_columns", None, "display.width", 200):
+            print(summary)